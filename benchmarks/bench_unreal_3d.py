@@ -0,0 +1,192 @@
+#   Benchmarks for the importer and exporter on synthetic meshes.
+#   Without Blender only the file format code (codec_unreal_3d) is timed:
+#       python benchmarks/bench_unreal_3d.py --out results.json
+#   Inside Blender make_mesh and write_files are timed as well:
+#       blender -b --factory-startup --python benchmarks/bench_unreal_3d.py -- --out results.json
+#   Cases are given as VERTICES,POLYGONS,FRAMES and every case is run in both formats unless --formats says otherwise.
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import io_u_vertex_m
+from io_u_vertex_m import codec_unreal_3d
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+#=======================================================================
+# Synthetic meshes.
+#=======================================================================
+def make_polys (vertcount, polycount, rng):
+    #Random polygons with three different vertices each.
+    first = rng.integers(0, vertcount, polycount)
+    vertindex = np.stack((first,
+                          (first + rng.integers(1, vertcount//2, polycount)) % vertcount,
+                          (first + rng.integers(vertcount//2, vertcount, polycount)) % vertcount), axis=1)
+
+    texnum = rng.integers(0, 4, polycount)
+    polyflags = rng.choice(np.array([0, 1, 2, 3, 0x10]), polycount)
+    uvs = rng.random((polycount, 3, 2), dtype=np.float32)
+    return vertindex, texnum, polyflags, uvs
+
+
+def make_frames (vertcount, numframes, rng):
+    #A blob of vertices that wobbles a bit every frame. Stays well within the range of both formats.
+    base = rng.uniform(-50, 50, (vertcount, 3)).astype(np.float32)
+    phase = np.linspace(0, 2*np.pi, numframes, endpoint=False, dtype=np.float32)
+    return base[None] + np.sin(phase)[:, None, None] * rng.uniform(-5, 5, (1, vertcount, 3)).astype(np.float32)
+
+
+def write_mesh (directory, name, vertcount, polycount, numframes, FORMAT, seed=0):
+    #Writes name_d.3d and name_a.3d. Returns the path to import (without _d/_a) and the frames.
+    rng = np.random.default_rng(seed)
+    vertindex, texnum, polyflags, uvs = make_polys(vertcount, polycount, rng)
+    frames = make_frames(vertcount, numframes, rng)
+
+    path = os.path.join(directory, name + ".3d")
+    with open(os.path.join(directory, name + "_d.3d"), "wb") as d:
+        d.write(codec_unreal_3d.encode_data_header(polycount, vertcount))
+        d.write(codec_unreal_3d.encode_polys(vertindex, texnum, polyflags, uvs))
+
+    framesize = vertcount * (4 if FORMAT == "UNREAL" else 8)
+    with codec_unreal_3d.AnimWriter(os.path.join(directory, name + "_a.3d"), framesize) as a:
+        for co in frames:
+            a.write_frame(codec_unreal_3d.encode_frame(co.ravel(), FORMAT))
+
+    return path, frames
+
+
+#=======================================================================
+# Timing.
+#=======================================================================
+def measure (func, repeat, elements):
+    #Best and mean wall time of func over repeat runs, plus throughput of the best run.
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {"best": best, "mean": sum(times)/len(times), "runs": repeat, "elements": elements,
+            "per_second": elements/best if best > 0 else None}
+
+
+def bench_codec (path, vertcount, polycount, numframes, FORMAT, frames, repeat):
+    results = {}
+    with open(path[:-3] + "_d.3d", "rb") as d:
+        DATAFILE = d.read()
+
+    results["data_header"] = measure(lambda: codec_unreal_3d.read_data_header(DATAFILE), repeat, 1)
+    results["poly_decode"] = measure(lambda: codec_unreal_3d.read_data(DATAFILE), repeat, polycount)
+    polys = codec_unreal_3d.read_data(DATAFILE)[2]
+    results["poly_clean"] = measure(lambda: codec_unreal_3d.clean_polys(polys, vertcount, "SPLIT"), repeat, polycount)
+
+    with codec_unreal_3d.AnimFile(path[:-3] + "_a.3d") as afile:
+        results["anim_header"] = measure(lambda: codec_unreal_3d.read_anim_header(afile.buffer), repeat, 1)
+        results["frame_decode"] = measure(lambda: afile.decode(vertcount, FORMAT), repeat, vertcount*numframes)
+
+    flat = frames.reshape(numframes, -1)
+    results["frame_pack"] = measure(lambda: [codec_unreal_3d.encode_frame(co, FORMAT) for co in flat], repeat, vertcount*numframes)
+
+    vertindex, texnum, polyflags = polys["vertindex"], polys["texnum"], polys["polyflags"]
+    uvs = polys["uvs"].astype(np.float32) / 256
+    results["poly_encode"] = measure(lambda: codec_unreal_3d.encode_polys(vertindex, texnum, polyflags, uvs), repeat, polycount)
+    return results
+
+
+def bench_blender (path, vertcount, polycount, numframes, FORMAT, directory, repeat):
+    #Full import and export through Blender. The imported objects are removed again between runs.
+    from io_u_vertex_m import import_unreal_3d, export_unreal_3d
+
+    results = {}
+    imported = []
+
+    def do_import ():
+        before = set(bpy.data.objects)
+        import_unreal_3d.make_mesh(path, True, FORMAT, True, 1, 1, 0, 1)
+        imported[:] = [ob for ob in bpy.data.objects if ob not in before]
+
+    def cleanup ():
+        for ob in imported:
+            me = ob.data
+            bpy.data.objects.remove(ob)
+            bpy.data.meshes.remove(me)
+        for col in [c for c in bpy.data.collections if not c.objects]:
+            bpy.data.collections.remove(col)
+
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        do_import()
+        times.append(time.perf_counter() - start)
+        if i < repeat-1:
+            cleanup()
+    best = min(times)
+    results["make_mesh"] = {"best": best, "mean": sum(times)/len(times), "runs": repeat, "elements": vertcount*numframes, "per_second": vertcount*numframes/best}
+
+    ob = imported[0]
+    exportpath = os.path.join(directory, "export.3d")
+    results["write_files"] = measure(lambda: export_unreal_3d.export(bpy.context, exportpath, ob, e_anim=True, a_format=FORMAT, a_source="SCENE", e_data=True, e_uc=False),
+                                     repeat, vertcount*numframes)
+    cleanup()
+    return results
+
+
+def main (argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else sys.argv[1:] #Blender's own arguments come before --.
+
+    parser = argparse.ArgumentParser(prog="bench_unreal_3d.py", description="Time the Unreal vertex mesh importer and exporter on synthetic meshes.")
+    parser.add_argument("--case", action="append", help="VERTICES,POLYGONS,FRAMES. Can be given more than once")
+    parser.add_argument("--formats", nargs="+", choices=("UNREAL", "ION"), default=["UNREAL", "ION"])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement. The best one counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-blender", action="store_true", help="Skip make_mesh and write_files even inside Blender")
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    cases = [tuple(int(n) for n in c.split(",")) for c in args.case] if args.case else [(500, 1000, 50), (4000, 8000, 200), (16000, 32000, 100)]
+
+    report = {"addon_version": list(io_u_vertex_m.bl_info["version"]),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "blender": bpy.app.version_string if bpy is not None else None,
+              "machine": platform.platform(),
+              "cases": []}
+
+    with tempfile.TemporaryDirectory(prefix="u3d_bench_") as directory:
+        for vertcount, polycount, numframes in cases:
+            for FORMAT in args.formats:
+                if vertcount*(4 if FORMAT == "UNREAL" else 8) > 0xffff:
+                    print ("Skipping {f} with {v} vertices, too many for the format.".format(f=FORMAT, v=vertcount))
+                    continue
+                name = "Bench{v}_{f}".format(v=vertcount, f=FORMAT)
+                path, frames = write_mesh(directory, name, vertcount, polycount, numframes, FORMAT, args.seed)
+
+                results = bench_codec(path, vertcount, polycount, numframes, FORMAT, frames, args.repeat)
+                if bpy is not None and not args.no_blender:
+                    results.update(bench_blender(path, vertcount, polycount, numframes, FORMAT, directory, args.repeat))
+
+                report["cases"].append({"format": FORMAT, "vertices": vertcount, "polygons": polycount, "frames": numframes, "results": results})
+                print ("{f} {v} verts, {p} polys, {n} frames:".format(f=FORMAT, v=vertcount, p=polycount, n=numframes))
+                for key, r in results.items():
+                    print ("    {k:<14}{b:10.3f} ms".format(k=key, b=r["best"]*1000))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print ("Results written to", args.out)
+    return report
+
+
+if __name__ == "__main__":
+    main()
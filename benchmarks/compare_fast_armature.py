@@ -0,0 +1,64 @@
+#   Checks fast armature evaluation against the depsgraph. Exports the actions of a mesh with the option off and on and compares every frame:
+#       blender -b Character.blend --python benchmarks/compare_fast_armature.py -- --object Body
+#   A vertex may differ by at most one quantization step of the format (the two paths can round a value on either side of a step).
+#   Exits with 1 if any frame differs by more, or if the mesh can't use fast armature evaluation at all.
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+
+import bpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_u_vertex_m import codec_unreal_3d, skin_unreal_3d, export_unreal_3d
+
+steps = {"UNREAL": np.array([1/8, 1/8, 1/4]), "ION": np.array([1/256, 1/256, 1/256])} #One quantization step per axis.
+
+
+def export_frames (ob, path, FORMAT, SCALE, FAST_ARMATURE):
+    export_unreal_3d.export(bpy.context, path, ob, e_anim=True, a_format=FORMAT, a_source="ACTIONS", e_scale=SCALE,
+                            e_data=False, e_uc=False, e_fast_armature=FAST_ARMATURE)
+    with codec_unreal_3d.AnimFile(path[:-3] + "_a.3d") as afile:
+        return afile.decode(len(ob.data.vertices), FORMAT)
+
+
+def main (argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="compare_fast_armature.py", description="Compare fast armature evaluation with the depsgraph frame by frame.")
+    parser.add_argument("--object", required=True, help="Mesh object deformed by an armature")
+    parser.add_argument("--formats", nargs="+", choices=("UNREAL", "ION"), default=["UNREAL", "ION"])
+    parser.add_argument("--scale", type=float, default=1)
+    args = parser.parse_args(argv)
+
+    ob = bpy.data.objects[args.object]
+    if skin_unreal_3d.get_skin(ob) is None:
+        print ("{o} can't use fast armature evaluation.".format(o=ob.name))
+        return 1
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="u3d_compare_") as directory:
+        for FORMAT in args.formats:
+            slow = export_frames(ob, os.path.join(directory, "slow.3d"), FORMAT, args.scale, False)
+            fast = export_frames(ob, os.path.join(directory, "fast.3d"), FORMAT, args.scale, True)
+            if slow.shape != fast.shape:
+                print ("{f}: {s} frames with the depsgraph, {n} with fast armature evaluation.".format(f=FORMAT, s=len(slow), n=len(fast)))
+                failed = True
+                continue
+
+            #Decoded coordinates are scaled and Y is flipped, so compare in steps of the format.
+            diff = np.abs(fast - slow) / (steps[FORMAT] * abs(args.scale))
+            worst = diff.max(axis=(1, 2)) if len(diff) else np.zeros(0)
+            bad = np.flatnonzero(worst > 1.001)
+            print ("{f}: {n} frames, largest difference {d:.2f} steps, {b} frames off by more than one step.".format(f=FORMAT, n=len(worst), d=worst.max() if len(worst) else 0, b=len(bad)))
+            for frame in bad[:20]:
+                print ("    frame {i}: {d:.2f} steps".format(i=frame, d=worst[frame]))
+            failed = failed or len(bad) > 0
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
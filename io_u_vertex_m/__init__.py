@@ -5,6 +5,34 @@
 #
 #   History:
 #
+#   1.4.0 - unreleased
+#       -Added codec_unreal_3d.py which reads the _d.3d header and polygon table in one go using NumPy. The importer now uses this instead of decoding every polygon byte by byte. This module doesn't need bpy so it can be used outside of Blender.
+#       -Animation frames (both Standard and ION Storm format) are now decoded for the whole imported range at once instead of one vertex at a time.
+#       -Importer now builds the mesh directly from the decoded arrays instead of creating vertices and polygons one by one with bmesh. The winding order is reversed in the data so the normals no longer need flipping in edit mode.
+#       -Shape keys for imported animation frames are now filled directly from the decoded frames instead of going through a bmesh copy of the whole mesh for every frame.
+#       -Importer now opens the files read-only (works on read-only drives) and closes them afterwards. The _a.3d file is memory mapped so only the imported frames get read from disk.
+#       -Added the option to import animation as a point cache (.pc2) with a Mesh Cache modifier instead of shape keys. Useful for very long animations.
+#       -Added the option to stream the animation from the _a.3d file. Only the current frame is read from the file whenever the frame changes.
+#       -Materials are now looked up once per texnum and polyflags combination instead of once per polygon.
+#       -Added the option to keep polygons that share all three vertices with another polygon by giving them their own vertices. Before these were always skipped.
+#       -Exporter now quantizes and packs the vertex coordinates of a whole frame at once instead of one vertex at a time.
+#       -Exporter now writes every animation frame to the _a.3d file as soon as it's evaluated instead of keeping the whole animation in memory.
+#       -Fixed the frame size in the _a.3d header using the vertex count of the mesh without modifiers.
+#       -Exporter now builds the whole polygon table of the _d.3d file at once instead of polygon by polygon.
+#       -Fixed polygons being written 3 bytes short in the _d.3d file when exporting a mesh without a UV layer.
+#       -Added fast armature evaluation when exporting Actions. Meshes that are only deformed by an Armature modifier are skinned directly from the actions instead of evaluating the whole scene for every frame. Off by default for now.
+#       -Added the option to evaluate the animation in a temporary scene containing only the exported mesh and what it depends on.
+#       -Fixed the exporter leaking an evaluated mesh for every exported frame. One coordinate buffer is now reused for all frames and the memory use of Blender after every action and its peak are reported when done.
+#       -Added the option to cache the exported frames of every action. Re-exporting only evaluates the actions that changed and copies the rest from the cache.
+#       -Added the option to export Actions with several background Blender processes at once. Each one exports part of the actions and the results are joined in the original order.
+#       -Added batch export of every mesh in a collection, as an operator (File > Export) and from the command line for several .blend files at once (python -m io_u_vertex_m.batch_unreal_3d). Every mesh gets the actions of the armature deforming it, meshes without one are exported as a single frame.
+#       -Exporter no longer triangulates meshes that only have triangles, and only triangulates the faces that need it otherwise.
+#       -Added convert_unreal_3d.py, a command line converter that doesn't need Blender. Converts whole folders of meshes to .obj, .glb or .ply per frame, or to .pc2 (python -m io_u_vertex_m.convert_unreal_3d).
+#       -Replaced the debug printing of the importer with the option to report how long every step of the import or export took, with element counts and throughput. Can also be written to a JSON file.
+#       -Long imports and exports now show their progress in Blender (and on the console when running in the background).
+#       -Importing and exporting now runs in small steps so Blender stays responsive. Press Esc to cancel, which removes the unfinished files or imported objects.
+#       -Fixed importing the frame after the last one (and failing) when the given frame is higher than the number of frames in the _a.3d file.
+#
 #   1.3.8 - 14/12/2024
 #       -Fixed issue with wrong material index being assigned to polygons. It now correctly searches in the object's assigned materials rather than the entire open .blend file's materials array.
 #
@@ -90,7 +118,7 @@
 bl_info = {
     "name": "Unreal Engine 1 Vertex Mesh Format",
     "author": "Skywolf",
-    "version": (1, 3, 8),
+    "version": (1, 4, 0),
     "blender": (4, 1, 1),
     "location": "File > Import-Export",
     "description": "Export and import _a.3d and _d.3d files",
@@ -99,255 +127,493 @@ bl_info = {
     "support": 'COMMUNITY',
     "category": "Import-Export"}
     
-import bpy
-from bpy.props import (
-        BoolProperty,
-        EnumProperty,
-        FloatProperty,
-        StringProperty,
-        CollectionProperty,
-        IntProperty
-        )
-from bpy_extras.io_utils import (
-        ImportHelper,
-        ExportHelper,
-        )
-
-class ImportUnrealVertexMesh(bpy.types.Operator, ImportHelper):
-    """Import from .3d file format (.3d)"""
-    bl_idname = "import_unreal_vertex_mesh.3d"
-    bl_label = 'Import Unreal vertex mesh'
+try:
+    import bpy
+except ImportError: #Not running inside Blender. Only the bpy-free modules (codec_unreal_3d) can be used.
+    bpy = None
+
+if bpy is not None:
+    from bpy.props import (
+            BoolProperty,
+            EnumProperty,
+            FloatProperty,
+            StringProperty,
+            CollectionProperty,
+            IntProperty
+            )
+    from bpy_extras.io_utils import (
+            ImportHelper,
+            ExportHelper,
+            )
+    from bpy.app.handlers import persistent
+    import time
+    import traceback
+
+    class ModalSteps:
+        #Runs the generator of work steps returned by the *_steps functions a few steps per timer event, so Blender stays responsive and Esc cancels.
+        #Scripts calling the operators and background mode (no window) run the steps to the end right away like before.
+        #Only one import or export can run at a time, the export and import modules keep their state in globals.
+        use_modal: BoolProperty(
+            default=False,
+            options={'HIDDEN', 'SKIP_SAVE'},
+            )
+
+        active = None #The operator whose steps are running.
+
+        @classmethod
+        def poll(cls, context):
+            return ModalSteps.active is None
+
+        def run_steps(self, context, steps):
+            if ModalSteps.active is not None:
+                self.report({'ERROR'}, "Another import or export is still running")
+                return {'CANCELLED'}
+            if not self.use_modal or context.window is None:
+                from . import progress_unreal_3d
+                return progress_unreal_3d.run_steps(steps)
+
+            self.steps = steps
+            ModalSteps.active = self
+            self.timer = context.window_manager.event_timer_add(0.01, window=context.window)
+            context.window_manager.modal_handler_add(self)
+            context.workspace.status_text_set("{l}... Press Esc to cancel".format(l=self.bl_label))
+            return {'RUNNING_MODAL'}
+
+        def modal(self, context, event):
+            if self.steps is None: #Cancelled by undo_cancel.
+                return {'CANCELLED'}
+
+            if event.type == 'ESC':
+                self.cancel(context)
+                self.report({'WARNING'}, "Cancelled")
+                return {'CANCELLED'}
+
+            if event.type in {'Z', 'Y'} and (event.ctrl or event.oskey): #Undo would free the objects the steps are working on.
+                if event.value == 'PRESS':
+                    self.report({'WARNING'}, "Can't undo while importing or exporting. Press Esc to cancel first")
+                return {'RUNNING_MODAL'}
+
+            if event.type != 'TIMER' or event.timer != self.timer:
+                return {'PASS_THROUGH'}
+
+            end = time.perf_counter() + 0.1 #Time spent working per timer event.
+            try:
+                while time.perf_counter() < end:
+                    if next(self.steps) is not None: #Only waiting (see progress_unreal_3d.run_steps). Give the time back to Blender until the next timer event.
+                        break
+            except StopIteration as stop:
+                self.finish(context)
+                return stop.value
+            except Exception as e:
+                traceback.print_exc()
+                self.finish(context)
+                self.report({'ERROR'}, str(e))
+                return {'CANCELLED'}
+
+            return {'RUNNING_MODAL'}
+
+        def cancel(self, context):
+            #Also called by Blender when the modal operator is stopped from outside, e.g. by loading another file.
+            if self.steps is None:
+                return
+            self.steps.close() #Raises GeneratorExit in the steps, which remove what was written or imported so far.
+            self.finish(context)
+
+        def finish(self, context):
+            self.steps = None
+            ModalSteps.active = None
+            context.window_manager.event_timer_remove(self.timer)
+            context.workspace.status_text_set(None)
+
+
+    @persistent
+    def undo_cancel(*args):
+        #undo_pre/redo_pre handler. Undo from the menu can't be blocked, so the running import or export is cancelled before its objects get freed.
+        if ModalSteps.active is not None:
+            print ("Undo while importing or exporting. Cancelling...")
+            ModalSteps.active.cancel(bpy.context)
+
+
+    class ImportUnrealVertexMesh(bpy.types.Operator, ImportHelper, ModalSteps):
+        """Import from .3d file format (.3d)"""
+        bl_idname = "import_unreal_vertex_mesh.3d"
+        bl_label = 'Import Unreal vertex mesh'
     
-    filename_ext = ".3d"
-    filter_glob: StringProperty(
-            default="*.3d",
-            options={'HIDDEN'},
+        filename_ext = ".3d"
+        filter_glob: StringProperty(
+                default="*.3d",
+                options={'HIDDEN'},
+                )
+
+        i_anim: BoolProperty(
+            name="Import Animation",
+            description="Import Animation. If unchecked it will only import the given frame",
+            default=True,
             )
 
-    i_anim: BoolProperty(
-        name="Import Animation",
-        description="Import Animation. If unchecked it will only import the given frame",
-        default=True,
-        )
-
-    a_format: EnumProperty(
-        name = "Format",
-        items=(("AUTO", "Automatic", "Automatically detects the format"),
-               ("UNREAL", "Standard", "Standard format used by most Unreal Engine 1 games"),
-               ("ION", "ION Storm", "Modified format used by ION Storm games (Deus Ex)"),
-               ))        
+        anim_mode: EnumProperty(
+            name = "Animation As",
+            items=(("SHAPEKEYS", "Shape Keys", "Stores every frame as a shape key in the .blend file"),
+                   ("PC2", "Point Cache", "Converts the animation to a .pc2 file (next to the .blend file, or the _a.3d file if the .blend isn't saved) and plays it back with a Mesh Cache modifier. Only the current frame is kept in memory"),
+                   ("STREAM", "Stream From File", "Reads the current frame from the _a.3d file whenever the frame changes. Fastest to import but the _a.3d file has to stay where it is"),
+                   ))
+
+        a_format: EnumProperty(
+            name = "Format",
+            items=(("AUTO", "Automatic", "Automatically detects the format"),
+                   ("UNREAL", "Standard", "Standard format used by most Unreal Engine 1 games"),
+                   ("ION", "ION Storm", "Modified format used by ION Storm games (Deus Ex)"),
+                   ))        
                
-    i_matt: BoolProperty(        
-        name="Create Materials",
-        description="Wether to create materials with correct naming for exporting",
-        default=True,
-        )
+        i_matt: BoolProperty(        
+            name="Create Materials",
+            description="Wether to create materials with correct naming for exporting",
+            default=True,
+            )
+        
+        i_dupes: EnumProperty(
+            name = "Duplicate Polygons",
+            description="What to do with polygons that use the same three vertices as another polygon (like double-sided polygons or weapon triangles). Blender can't have two polygons share all their vertices",
+            items=(("DROP", "Skip", "Don't import these polygons"),
+                   ("SPLIT", "Keep as Split Vertices", "Give these polygons their own copies of the vertices so they survive exporting again"),
+                   ))
+            
+        i_scale: FloatProperty(
+            name = "Scale",
+            description="Scaling of the imported model. It's not uncommon for Unreal meshes to be rather large. This allows the model to be scaled down",
+            default = 1,
+            )
+        
+        frame_start: IntProperty(
+            name="From frame",
+            default=1,
+            min=1,
+            )
+
+        frame_end: IntProperty(
+            name="To frame",
+            description="Set to 0 for all frames. If this value is higher than the number of animation frames in the _a.3d file the end frame will be that last frame instead",
+            default=0,
+            min=0,
+            )
+
+        frame_single: IntProperty(
+            name="Frame",
+            description="If this value is higher than the number of animation frames in the _a.3d file the last frame will be imported instead",
+            default=1,
+            min=1,
+            )
         
-    i_scale: FloatProperty(
-        name = "Scale",
-        description="Scaling of the imported model. It's not uncommon for Unreal meshes to be rather large. This allows the model to be scaled down",
-        default = 1,
-        )
+        timing: BoolProperty(
+            name="Report Timing",
+            description="Print how long each step of the import took to the console",
+            default=False,
+            )
         
-    frame_start: IntProperty(
-        name="From frame",
-        default=1,
-        min=1,
-        )
-
-    frame_end: IntProperty(
-        name="To frame",
-        description="Set to 0 for all frames. If this value is higher than the number of animation frames in the _a.3d file the end frame will be that last frame instead",
-        default=0,
-        min=0,
-        )
-
-    frame_single: IntProperty(
-        name="Frame",
-        description="If this value is higher than the number of animation frames in the _a.3d file the last frame will be imported instead",
-        default=1,
-        min=1,
-        )
+        timing_path: StringProperty(
+            name="Timing File",
+            description="Also write the timing report to this JSON file. Leave empty to only print it",
+            default="",
+            subtype='FILE_PATH',
+            )
 
         
-    def draw(self, context):
-        layout = self.layout
-        layout.prop(self, "i_scale")
-        layout.prop(self, "i_anim")
-        if self.i_anim:
-            layout.prop(self, "frame_start")
-            layout.prop(self, "frame_end")
-        else:
-            layout.prop(self, "frame_single")
-        layout.separator()
-        layout.prop(self, "a_format")
-        layout.prop(self, "i_matt")
-
-    def execute(self, context):
-        from . import import_unreal_3d
+        def draw(self, context):
+            layout = self.layout
+            layout.prop(self, "i_scale")
+            layout.prop(self, "i_anim")
+            if self.i_anim:
+                layout.prop(self, "anim_mode")
+                layout.prop(self, "frame_start")
+                layout.prop(self, "frame_end")
+            else:
+                layout.prop(self, "frame_single")
+            layout.separator()
+            layout.prop(self, "a_format")
+            layout.prop(self, "i_matt")
+            layout.prop(self, "i_dupes")
+            layout.separator()
+            layout.prop(self, "timing")
+            if self.timing:
+                layout.prop(self, "timing_path")
+
+        def execute(self, context):
+            from . import import_unreal_3d
         
-        keywords = self.as_keywords(ignore=("axis_forward",
-                                            "axis_up",
-                                            "filter_glob",
-                                            "check_existing",
-                                            ))
+            keywords = self.as_keywords(ignore=("axis_forward",
+                                                "axis_up",
+                                                "filter_glob",
+                                                "check_existing",
+                                                "use_modal",
+                                                ))
                                     
-        return import_unreal_3d.load(self, context, **keywords)
+            return self.run_steps(context, import_unreal_3d.load_steps(self, context, **keywords))
+
+        def invoke(self, context, event):
+            self.use_modal = True
+            return ImportHelper.invoke(self, context, event)
         
         
-class ExportUnrealVertexMesh(bpy.types.Operator, ExportHelper):
-    """Export to .3d file format (.3d)"""
-    bl_idname = "export_unreal_vertex_mesh.3d"
-    bl_label = 'Export Unreal vertex mesh'
-    
-    filename_ext = ".3d"
-    filter_glob: StringProperty(
-            default="*.3d",
-            options={'HIDDEN'},
+    class ExportUnrealOptions:
+        #Export settings shared by the export and batch export operators.
+        e_anim: BoolProperty(
+            name="Animation file (_a.3d)",
+            description="Export vertex animation file",
+            default=True,
             )
-
-    e_anim: BoolProperty(
-        name="Animation file (_a.3d)",
-        description="Export vertex animation file",
-        default=True,
-        )
         
-    a_format: EnumProperty(
-        name = "Format",
-        items=(("UNREAL", "Standard", "Standard format used by most Unreal Engine 1 games"),
-               ("ION", "ION Storm", "Modified format used by ION Storm games (Deus Ex)"),
-               ))
+        a_format: EnumProperty(
+            name = "Format",
+            items=(("UNREAL", "Standard", "Standard format used by most Unreal Engine 1 games"),
+                   ("ION", "ION Storm", "Modified format used by ION Storm games (Deus Ex)"),
+                   ))
                    
-    a_source: EnumProperty(
-        name = "Source",
-        items=(("ACTIONS", "Actions", "Get animations from Actions. Be sure to have all Objects affecting the Mesh selected with the Mesh as the Active Object (selected last)"),
-               ("SCENE", "Scene Timeline", "Get animation from the current scene timeline. Be sure to only select the Mesh"),
-               ))
+        a_source: EnumProperty(
+            name = "Source",
+            items=(("ACTIONS", "Actions", "Get animations from Actions. Be sure to have all Objects affecting the Mesh selected with the Mesh as the Active Object (selected last)"),
+                   ("SCENE", "Scene Timeline", "Get animation from the current scene timeline. Be sure to only select the Mesh"),
+                   ))
                
-    e_scale: FloatProperty(
-        name = "Scale",
-        description="Scale of the exported model. Increasing this will allow for higher detail but setting this too high will cause the model to get squished when it goes too far outside the boundries. \n The model should still fit within 256 x 256 Blender units after this scale is applied",
-        default = 1,
-        )
+        e_scale: FloatProperty(
+            name = "Scale",
+            description="Scale of the exported model. Increasing this will allow for higher detail but setting this too high will cause the model to get squished when it goes too far outside the boundries. \n The model should still fit within 256 x 256 Blender units after this scale is applied",
+            default = 1,
+            )
+    
+        e_fast_armature: BoolProperty(
+            name="Fast Armature Evaluation",
+            description="If the mesh is only deformed by an Armature modifier (no constraints, drivers or shape keys), calculate the deformation directly from the actions instead of evaluating the whole scene for every frame. Falls back to the normal method for anything else. Experimental, compare the result with a normal export",
+            default=False,
+            )
+    
+        e_isolate: BoolProperty(
+            name="Evaluate in Isolation",
+            description="Evaluate the animation in a temporary scene containing only the selected objects and the objects they depend on (parents, modifier, constraint and driver targets). Makes exporting from large scenes faster. The temporary scene is removed afterwards",
+            default=False,
+            )
     
-    e_data: BoolProperty(
-        name="Data file (_d.3d)",
-        description="Export vertex data file containing polygon flags .etc",
-        default=True,
-        )
+        e_cache: BoolProperty(
+            name="Cache Actions",
+            description="Keep the exported frames of every action in a .u3d_cache folder next to the _a.3d file. On the next export only the actions that changed (or the mesh they deform) are evaluated again, the rest is copied from the cache. Delete the folder if something else affecting the animation changed, like drivers or constraint targets",
+            default=False,
+            )
+    
+        e_workers: IntProperty(
+            name="Workers",
+            description="Number of background Blender processes to split the actions between. Each one evaluates its share of the actions from a copy of the .blend file, then the results are joined in the original order. 1 exports everything in this Blender",
+            default=1,
+            min=1,
+            max=64,
+            )
+    
+        e_data: BoolProperty(
+            name="Data file (_d.3d)",
+            description="Export vertex data file containing polygon flags .etc",
+            default=True,
+            )
     
-    e_uc: BoolProperty(
-        name="Unreal script (.uc)",
-        description="Makes an Unreal script file with #exec commands to import the mesh using ucc -make",
-        default=True,
-        )
+        e_uc: BoolProperty(
+            name="Unreal script (.uc)",
+            description="Makes an Unreal script file with #exec commands to import the mesh using ucc -make",
+            default=True,
+            )
         
 
-    lod: BoolProperty(
-        name="Make mesh a LODMesh.",
-        description="Wether the mesh will be a LODMesh (geometry collapses if the player is far enough from the mesh)",
-        default=True,
-        )
-
-    lod_style: IntProperty(
-        name="LODSTYLE",
-        description="1: Value curvature over length.\n2: Protect the edges of doublesided polygons - like the CTF flags.\n4: Try to respect texture seams more. Use this if there is too much 'stretching' going on.\n8: Value length over curvature. Needed for unwelded, multi-element, or otherwise 'open' meshes.\n16: Translucent polygons will be collapsed less early in the LOD sequence.\n\nOptions can be combined by adding together the desired values",
-        default=10,
-        min=0, max=31,
-        )
+        lod: BoolProperty(
+            name="Make mesh a LODMesh.",
+            description="Wether the mesh will be a LODMesh (geometry collapses if the player is far enough from the mesh)",
+            default=True,
+            )
+
+        lod_style: IntProperty(
+            name="LODSTYLE",
+            description="1: Value curvature over length.\n2: Protect the edges of doublesided polygons - like the CTF flags.\n4: Try to respect texture seams more. Use this if there is too much 'stretching' going on.\n8: Value length over curvature. Needed for unwelded, multi-element, or otherwise 'open' meshes.\n16: Translucent polygons will be collapsed less early in the LOD sequence.\n\nOptions can be combined by adding together the desired values",
+            default=10,
+            min=0, max=31,
+            )
+        
+        lod_frame: IntProperty(
+            name="LODFRAME",
+            description="Animation frame used for generating the LOD collapse sequence",
+            default=0,
+            min=0,
+            )      
         
-    lod_frame: IntProperty(
-        name="LODFRAME",
-        description="Animation frame used for generating the LOD collapse sequence",
-        default=0,
-        min=0,
-        )      
+        e_to_folders: BoolProperty(
+            name="Export to ucc folder structure",
+            description="Export to folders in the currently selected directory for ucc -make. Also affects the class (.uc) file. If a folder doesn't exist it will be created",
+            default=False,
+            )
         
-    e_to_folders: BoolProperty(
-        name="Export to ucc folder structure",
-        description="Export to folders in the currently selected directory for ucc -make. Also affects the class (.uc) file. If a folder doesn't exist it will be created",
-        default=False,
-        )
+        modeldir: StringProperty(
+            name="Data File Folder",
+            description="Folder to write the data (_d.3d) file to",
+            default="Models",
+            )
         
-    modeldir: StringProperty(
-        name="Data File Folder",
-        description="Folder to write the data (_d.3d) file to",
-        default="Models",
-        )
+        animdir: StringProperty(
+            name="Animation File Folder",
+            description="Folder to write the animation (_a.3d) file to",
+            default="Models",
+            )
+        
+        classdir: StringProperty(
+            name="Classes Folder",
+            description="Folder to write the class (.uc) file to",
+            default="Classes",
+            )
         
-    animdir: StringProperty(
-        name="Animation File Folder",
-        description="Folder to write the animation (_a.3d) file to",
-        default="Models",
-        )
+        texdir: StringProperty(
+            name="Textures Folder",
+            description="Folder to where the Textures are stored. Used for the .uc file",
+            default="Textures",
+            )   
         
-    classdir: StringProperty(
-        name="Classes Folder",
-        description="Folder to write the class (.uc) file to",
-        default="Classes",
-        )
+        timing: BoolProperty(
+            name="Report Timing",
+            description="Print how long each step of the export took to the console",
+            default=False,
+            )
         
-    texdir: StringProperty(
-        name="Textures Folder",
-        description="Folder to where the Textures are stored. Used for the .uc file",
-        default="Textures",
-        )   
-
-    def draw(self, context):
-        layout = self.layout
-        layout.prop(self, "e_anim")
-        layout.prop(self, "a_format")
-        layout.prop(self, "a_source")
-        layout.prop(self, "e_scale")
-        layout.prop(self, "e_data")
-        layout.prop(self, "e_uc")
-        if self.e_uc:
-            layout.prop(self, "lod")
-            if self.lod:
-                layout.prop(self, "lod_style")
-                layout.prop(self, "lod_frame")              
-        layout.separator()
-        layout.prop(self, "e_to_folders")
+        timing_path: StringProperty(
+            name="Timing File",
+            description="Also write the timing report to this JSON file. Leave empty to only print it",
+            default="",
+            subtype='FILE_PATH',
+            )
+
+        def draw(self, context):
+            layout = self.layout
+            layout.prop(self, "e_anim")
+            layout.prop(self, "a_format")
+            layout.prop(self, "a_source")
+            if self.a_source == "ACTIONS":
+                layout.prop(self, "e_fast_armature")
+                layout.prop(self, "e_cache")
+                layout.prop(self, "e_workers")
+            layout.prop(self, "e_isolate")
+            layout.prop(self, "e_scale")
+            layout.prop(self, "e_data")
+            layout.prop(self, "e_uc")
+            if self.e_uc:
+                layout.prop(self, "lod")
+                if self.lod:
+                    layout.prop(self, "lod_style")
+                    layout.prop(self, "lod_frame")              
+            layout.separator()
+            layout.prop(self, "e_to_folders")
         
-        if self.e_to_folders:
-            layout.prop(self, "modeldir")
-            layout.prop(self, "animdir")
-            layout.prop(self, "classdir")
-            layout.prop(self, "texdir")
+            if self.e_to_folders:
+                layout.prop(self, "modeldir")
+                layout.prop(self, "animdir")
+                layout.prop(self, "classdir")
+                layout.prop(self, "texdir")
+            layout.separator()
+            layout.prop(self, "timing")
+            if self.timing:
+                layout.prop(self, "timing_path")
 
+
+    class ExportUnrealVertexMesh(bpy.types.Operator, ExportHelper, ExportUnrealOptions, ModalSteps):
+        """Export to .3d file format (.3d)"""
+        bl_idname = "export_unreal_vertex_mesh.3d"
+        bl_label = 'Export Unreal vertex mesh'
+    
+        filename_ext = ".3d"
+        filter_glob: StringProperty(
+                default="*.3d",
+                options={'HIDDEN'},
+                )
         
-    def execute(self, context):
-        from . import export_unreal_3d
+        def execute(self, context):
+            from . import export_unreal_3d
         
-        keywords = self.as_keywords(ignore=("axis_forward",
-                                            "axis_up",
-                                            "filter_glob",
-                                            "check_existing",
-                                            ))
+            keywords = self.as_keywords(ignore=("axis_forward",
+                                                "axis_up",
+                                                "filter_glob",
+                                                "check_existing",
+                                                "use_modal",
+                                                ))
                                     
-        return export_unreal_3d.save(self, context, **keywords)
+            return self.run_steps(context, export_unreal_3d.save_steps(self, context, **keywords))
+
+        def invoke(self, context, event):
+            self.use_modal = True
+            return ExportHelper.invoke(self, context, event)
+
+
+    class BatchExportUnrealVertexMesh(bpy.types.Operator, ExportUnrealOptions, ModalSteps):
+        """Export every mesh in a collection to its own .3d files"""
+        bl_idname = "export_unreal_vertex_mesh.batch"
+        bl_label = 'Batch export Unreal vertex meshes'
+        
+        directory: StringProperty(
+            subtype='DIR_PATH',
+            )
+        
+        collection: StringProperty(
+            name="Collection",
+            description="Collection with the meshes to export (child collections included). Every mesh is exported to files named after the object. Leave empty for the whole scene",
+            default="",
+            )
+        
+        def invoke(self, context, event):
+            if not self.collection and context.collection != context.scene.collection:
+                self.collection = context.collection.name
+            self.use_modal = True
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+        
+        def draw(self, context):
+            self.layout.prop_search(self, "collection", bpy.data, "collections")
+            ExportUnrealOptions.draw(self, context)
+            
+        def execute(self, context):
+            from . import batch_unreal_3d
+            
+            keywords = self.as_keywords(ignore=("directory",
+                                                "collection",
+                                                "use_modal",
+                                                ))
+            
+            return self.run_steps(context, batch_unreal_3d.save_steps(self, context, self.directory, self.collection, **keywords))
 
-# Add to a menu
-def menu_func_export(self, context):
-    self.layout.operator(ExportUnrealVertexMesh.bl_idname, text="Unreal Engine Vertex Mesh (_a.3d, _d.3d)")
+    # Add to a menu
+    def menu_func_export(self, context):
+        self.layout.operator(ExportUnrealVertexMesh.bl_idname, text="Unreal Engine Vertex Mesh (_a.3d, _d.3d)")
+        self.layout.operator(BatchExportUnrealVertexMesh.bl_idname, text="Unreal Engine Vertex Mesh Batch (_a.3d, _d.3d)")
 
-def menu_func_import(self, context):
-    self.layout.operator(ImportUnrealVertexMesh.bl_idname, text="Unreal Engine Vertex Mesh (_a.3d, _d.3d)")
+    def menu_func_import(self, context):
+        self.layout.operator(ImportUnrealVertexMesh.bl_idname, text="Unreal Engine Vertex Mesh (_a.3d, _d.3d)")
 
-def register():
-    bpy.utils.register_class(ExportUnrealVertexMesh)
-    bpy.utils.register_class(ImportUnrealVertexMesh)
+    def register():
+        from . import import_unreal_3d
+        
+        bpy.utils.register_class(ExportUnrealVertexMesh)
+        bpy.utils.register_class(BatchExportUnrealVertexMesh)
+        bpy.utils.register_class(ImportUnrealVertexMesh)
     
-    bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
-    bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+        bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
+        bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+        
+        import_unreal_3d.register_stream_handler() #Needed for meshes imported with "Stream From File" in previously saved .blend files.
+        bpy.app.handlers.undo_pre.append(undo_cancel)
+        bpy.app.handlers.redo_pre.append(undo_cancel)
 
 
-def unregister():
-    bpy.utils.unregister_class(ExportUnrealVertexMesh)
-    bpy.utils.unregister_class(ImportUnrealVertexMesh)
+    def unregister():
+        from . import import_unreal_3d
+        
+        import_unreal_3d.unregister_stream_handler()
+        bpy.app.handlers.undo_pre.remove(undo_cancel)
+        bpy.app.handlers.redo_pre.remove(undo_cancel)
+        
+        bpy.utils.unregister_class(ExportUnrealVertexMesh)
+        bpy.utils.unregister_class(BatchExportUnrealVertexMesh)
+        bpy.utils.unregister_class(ImportUnrealVertexMesh)
 
-    bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
-    bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+        bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
+        bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
 
-if __name__ == "__main__":
-    register()
+    if __name__ == "__main__":
+        register()
@@ -0,0 +1,142 @@
+#   V1.4.0
+#   Batch export. Exports every mesh in a collection to its own _d.3d/_a.3d/.uc files, from the batch export operator or from the command line:
+#       python -m io_u_vertex_m.batch_unreal_3d --out Export --collection Pickups --jobs 4 Pickups.blend Decorations.blend
+#   On the command line every .blend file is loaded once by its own background Blender process, up to --jobs of them at a time.
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from . import progress_unreal_3d
+
+try:
+    import bpy
+except ImportError: #Command line.
+    bpy = None
+
+
+#=======================================================================
+# Inside Blender.
+#=======================================================================
+def get_objects (collection=""):
+    #Meshes in the collection (and its children), or in the whole scene if no collection is given.
+    if collection:
+        col = bpy.data.collections.get(collection)
+        if col is None:
+            raise Exception("Error: Collection {c} not found. Aborting...".format(c=collection))
+        objects = col.all_objects
+    else:
+        objects = bpy.context.scene.collection.all_objects
+
+    return [ob for ob in objects if ob.type == 'MESH']
+
+
+def export_objects (context, directory, collection="", **keywords):
+    #Exports every mesh to directory/<object name>.3d. keywords are the export operator's settings.
+    return progress_unreal_3d.run_steps(export_objects_steps(context, directory, collection, **keywords))
+
+
+def export_objects_steps (context, directory, collection="", **keywords):
+    #Generator version of export_objects, see export_unreal_3d.write_files_steps.
+    from . import export_unreal_3d
+
+    exported = []
+    for ob in get_objects(collection):
+        filepath = os.path.join(directory, bpy.path.clean_name(ob.name) + ".3d")
+        print ("Exporting {o}...".format(o=ob.name))
+        yield from export_unreal_3d.export_steps(context, filepath, ob, **keywords)
+        exported.append(ob.name)
+
+    return exported
+
+
+def save (operator, context, directory, collection="", **keywords):
+    return progress_unreal_3d.run_steps(save_steps(operator, context, directory, collection, **keywords))
+
+
+def save_steps (operator, context, directory, collection="", **keywords):
+    exported = yield from export_objects_steps(context, directory, collection, **keywords)
+    operator.report({'INFO'}, "Exported {n} meshes.".format(n=len(exported)))
+
+    return {'FINISHED'}
+
+
+def export_file (argpath):
+    #Runs inside the background Blender process started by run_file.
+    with open (argpath, 'r', encoding = 'utf-8') as f:
+        args = json.load(f)
+
+    os.makedirs(args["directory"], exist_ok=True)
+    exported = export_objects(bpy.context, args["directory"], args["collection"], **args["keywords"])
+    print ("Exported {n} meshes from {f}.".format(n=len(exported), f=bpy.data.filepath))
+
+
+#=======================================================================
+# Command line.
+#=======================================================================
+def run_file (blender, blendpath, directory, collection, keywords, argpath):
+    #Exports one .blend file with a background Blender process. Returns the exit code and the output of the process.
+    with open (argpath, 'w', encoding = 'utf-8') as f:
+        json.dump({"directory": directory, "collection": collection, "keywords": keywords}, f)
+
+    package = os.path.dirname(os.path.abspath(__file__))
+    expr = ("import sys; sys.path.insert(0, {p!r}); "
+            "from {m}.batch_unreal_3d import export_file; export_file(sys.argv[sys.argv.index('--')+1])").format(p=os.path.dirname(package), m=os.path.basename(package))
+
+    result = subprocess.run([blender, "-b", blendpath, "--python-exit-code", "1", "--python-expr", expr, "--", argpath],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return result.returncode, result.stdout.decode('utf-8', 'replace')
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="python -m io_u_vertex_m.batch_unreal_3d",
+                                     description="Export every mesh in a collection of one or more .blend files to Unreal Engine 1 vertex meshes.")
+    parser.add_argument("files", nargs="+", help=".blend files to export")
+    parser.add_argument("--out", required=True, help="Output folder. Every .blend file gets a subfolder named after it")
+    parser.add_argument("--collection", default="", help="Collection with the meshes to export. Whole scene if not given")
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of .blend files exported at the same time")
+    parser.add_argument("--format", choices=("UNREAL", "ION"), default="UNREAL")
+    parser.add_argument("--source", choices=("ACTIONS", "SCENE"), default="ACTIONS")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--no-anim", action="store_true", help="Don't export _a.3d files")
+    parser.add_argument("--no-data", action="store_true", help="Don't export _d.3d files")
+    parser.add_argument("--no-uc", action="store_true", help="Don't export .uc files")
+    parser.add_argument("--no-lod", action="store_true", help="Don't make the meshes LODMeshes")
+    parser.add_argument("--folders", action="store_true", help="Export to the ucc folder structure")
+    parser.add_argument("--fast-armature", action="store_true", help="Experimental fast armature evaluation")
+    parser.add_argument("--isolate", action="store_true")
+    parser.add_argument("--cache", action="store_true")
+    parser.add_argument("--workers", type=int, default=1, help="Background Blender processes per .blend file for exporting actions")
+    args = parser.parse_args(argv)
+
+    keywords = {"e_anim": not args.no_anim, "a_format": args.format, "a_source": args.source, "e_scale": args.scale,
+                "e_data": not args.no_data, "e_uc": not args.no_uc, "lod": not args.no_lod, "e_to_folders": args.folders,
+                "e_fast_armature": args.fast_armature, "e_isolate": args.isolate, "e_cache": args.cache, "e_workers": args.workers}
+
+    failed = []
+    with tempfile.TemporaryDirectory(prefix="u3d_batch_") as tmpdir, ThreadPoolExecutor(max(args.jobs, 1)) as pool: #Every job is its own Blender process.
+        jobs = []
+        for i, blendpath in enumerate(args.files):
+            blendpath = os.path.abspath(blendpath)
+            directory = os.path.join(os.path.abspath(args.out), os.path.splitext(os.path.basename(blendpath))[0])
+            argpath = os.path.join(tmpdir, "{i}.json".format(i=i))
+            jobs.append((blendpath, pool.submit(run_file, args.blender, blendpath, directory, args.collection, keywords, argpath)))
+
+        for blendpath, job in jobs:
+            code, output = job.result()
+            if code != 0:
+                print (output)
+                print ("Failed to export {f}.".format(f=blendpath))
+                failed.append(blendpath)
+            else:
+                print ("{f} exported successfully.".format(f=blendpath))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+#   V1.4.0
+#   Reading and writing of the raw _d.3d and _a.3d tables using NumPy.
+#   This module must not import bpy so it can be used (and tested) outside of Blender.
+import mmap
+import numpy as np
+
+#Constants:
+polysize = 16
+dheadersize = 48
+
+aheadersize = 4
+
+
+#=======================================================================
+# Data file (_d.3d).
+#=======================================================================
+data_header_dtype = np.dtype([("polycount", "<u2"),
+                              ("vertcount", "<u2"),
+                              ("unusedrot", "<u2"),
+                              ("unusedframe", "<u2"),
+                              ("unusednorm", "<u4", 3),
+                              ("unusedscale", "<u4"),
+                              ("genunused", "u1", 12),
+                              ("moreunused", "u1", 12)])
+
+poly_dtype = np.dtype([("vertindex", "<u2", 3),
+                       ("polyflags", "u1"),
+                       ("meshcolor", "u1"), #unused
+                       ("uvs", "u1", (3, 2)), #u, v per vertex
+                       ("texnum", "u1"),
+                       ("unusedflags", "u1")])
+
+
+def read_data_header (DATAFILE):
+    if len(DATAFILE) < dheadersize:
+        raise Exception("Error: Data file is too small to contain a header. Aborting...")
+    header = np.frombuffer(DATAFILE, dtype=data_header_dtype, count=1)[0]
+
+    return int(header["polycount"]), int(header["vertcount"])
+
+
+def read_data_polys (DATAFILE, polycount):
+    if len(DATAFILE) < dheadersize + polycount*polysize:
+        raise Exception("Error: Data file is smaller than its polygon count says it should be. Aborting...")
+
+    return np.frombuffer(DATAFILE, dtype=poly_dtype, count=polycount, offset=dheadersize)
+
+
+def read_data (DATAFILE):
+    #Returns the polygon and vertex count and the whole polygon table as a structured array (see poly_dtype).
+    polycount, vertcount = read_data_header(DATAFILE)
+
+    return polycount, vertcount, read_data_polys(DATAFILE, polycount)
+
+
+def encode_data_header (polycount, vertcount):
+    if polycount > 0xffff or vertcount > 0xffff:
+        raise Exception("Error: Too many polygons or vertices for the data file (max 65535). Aborting...")
+    header = np.zeros(1, dtype=data_header_dtype)
+    header["polycount"] = polycount
+    header["vertcount"] = vertcount
+
+    return header
+
+
+def quantize_uvs (uvs):
+    #Blender UVs (0-1, V up) to Unreal's 0-255 byte UVs (V down). Same as truncating (u+1/255)*255 and abs(trunc(v*255)-255), clamped to 0-255.
+    uvs = np.asarray(uvs, dtype=np.float64)
+    quant = np.empty(uvs.shape, dtype=np.float64)
+    quant[..., 0] = np.trunc((uvs[..., 0]+(1/255))*255) #add offset of 1 pixel
+    quant[..., 1] = np.abs(np.trunc(uvs[..., 1]*255)-255) #Unreal V coords are the inverse of Blender's
+
+    return np.clip(quant, 0, 255).astype(np.uint8)
+
+
+def encode_polys (vertindex, texnum, polyflags, uvs=None):
+    #Builds the whole polygon table (see poly_dtype) at once.
+    #vertindex is (polys, 3) and uvs (polys, 3, 2) in Blender's winding order, which gets reversed. Without uvs they're left at 0.
+    table = np.zeros(len(vertindex), dtype=poly_dtype)
+    table["vertindex"] = np.asarray(vertindex)[:, (0, 2, 1)]
+    table["polyflags"] = polyflags
+    if uvs is not None:
+        table["uvs"] = quantize_uvs(uvs)[:, (0, 2, 1)]
+    table["texnum"] = texnum
+
+    return table
+
+
+def degenerate_polys (vertindex, vertcount):
+    #Polygons using the same vertex twice or a vertex that doesn't exist. Blender can't create these.
+    return ((vertindex[:, 0] == vertindex[:, 1]) |
+            (vertindex[:, 1] == vertindex[:, 2]) |
+            (vertindex[:, 2] == vertindex[:, 0]) |
+            (vertindex.max(axis=1) >= vertcount))
+
+
+def duplicate_polys (vertindex):
+    #Polygons using the same three vertices as an earlier polygon (in any order). Blender can't have two polygons sharing all their vertices.
+    #Found in bulk by hashing the sorted vertex triples.
+    tris = np.sort(vertindex, axis=1).astype(np.int64)
+    key = (tris[:, 0] << 32) | (tris[:, 1] << 16) | tris[:, 2]
+
+    duplicates = np.ones(len(tris), dtype=bool)
+    duplicates[np.unique(key, return_index=True)[1]] = False
+
+    return duplicates
+
+
+def split_polys (vertindex, split, vertcount):
+    #Gives the polygons in the split mask their own copies of their vertices so they don't share all three with another polygon.
+    #Returns the new vertex indices and the vertmap which holds the original vertex of every vertex in the result.
+    vertindex = vertindex.astype(np.int32)
+    copies = vertindex[split].ravel()
+
+    vertindex[split] = (vertcount + np.arange(len(copies), dtype=np.int32)).reshape(-1, 3)
+    vertmap = np.concatenate((np.arange(vertcount, dtype=np.int32), copies))
+
+    return vertindex, vertmap
+
+
+def clean_polys (polys, vertcount, DUPES="DROP"):
+    #Removes the polygons Blender can't have. Duplicates (see duplicate_polys) are dropped, or given their own vertices if DUPES is "SPLIT".
+    #Returns the polygons, their vertex indices, the vertmap (None if nothing was split) and the number of degenerate and duplicate polygons.
+    degenerate = degenerate_polys(polys["vertindex"], vertcount)
+    polys = polys[~degenerate]
+
+    vertindex = polys["vertindex"]
+    vertmap = None
+    duplicates = duplicate_polys(vertindex)
+    if duplicates.any():
+        if DUPES == "SPLIT":
+            vertindex, vertmap = split_polys(vertindex, duplicates, vertcount)
+        else:
+            polys = polys[~duplicates]
+            vertindex = polys["vertindex"]
+
+    return polys, vertindex, vertmap, int(degenerate.sum()), int(duplicates.sum())
+
+
+def loop_vertices (vertindex):
+    #Vertex index of every polygon corner. The winding is reversed so the normals point outwards.
+    return vertindex[:, (0, 2, 1)].ravel().astype(np.int32)
+
+
+def loop_uvs (polys):
+    #UV of every polygon corner (same order as loop_vertices) with the origin at the bottom left.
+    uvs = polys["uvs"][:, (0, 2, 1)].reshape(-1, 2) / 256
+    uvs[:, 1] = (uvs[:, 1]*-1)+1
+    return uvs.astype(np.float32)
+
+
+def material_name (texnum, polyflags, name):
+    mtname = str(int(texnum))
+    mtname = ("0"*(3-len(mtname)))+mtname
+    
+    if (polyflags & 0xF) == 1: mtname+="_2SIDED"
+    elif (polyflags & 0xF) == 2: mtname+="_TRANSLUCENT"
+    elif (polyflags & 0xF) == 3: mtname+="_MASKED"
+    elif (polyflags & 0xF) == 4: mtname+="_MODULATED"
+    elif (polyflags & 0xF) == 5: mtname+="_ALPHABLEND"
+    elif (polyflags & 0xF) == 8: mtname+="_WEAPONTRI"
+    else: mtname+="_NORMAL"
+    
+    if ((polyflags >> 4) & 0x1) == 1: mtname+="_UNLIT"
+    if ((polyflags >> 5) & 0x1) == 1: mtname+="_FLAT"
+    if ((polyflags >> 6) & 0x1) == 1: mtname+="_ENVIRONMENT"
+    if ((polyflags >> 7) & 0x1) == 1: mtname+="_NOSMOOTH"
+    
+    mtname+="_"
+    mtname+=name
+    
+    return mtname
+
+
+#=======================================================================
+# Animation file (_a.3d).
+#=======================================================================
+anim_header_dtype = np.dtype([("numframes", "<u2"),
+                              ("framesize", "<u2")])
+
+
+def read_anim_header (ANIMFILE):
+    if len(ANIMFILE) < aheadersize:
+        raise Exception("Error: Animation file is too small to contain a header. Aborting...")
+    header = np.frombuffer(ANIMFILE, dtype=anim_header_dtype, count=1)[0]
+
+    return int(header["numframes"]), int(header["framesize"])
+
+
+def detect_format (framesize, vertcount):
+    #The frame size is the only thing that tells the formats apart. Unreal uses 4 bytes per vertex, ION Storm uses 8.
+    if vertcount and framesize == vertcount*4:
+        return "UNREAL"
+    elif vertcount and framesize == vertcount*8:
+        return "ION"
+    return None
+
+
+def frame_table (ANIMFILE, vertcount, framesize, vertsize, dtype, start, end, components=None):
+    #Strided view over the frames start to end (exclusive) without copying. Each row is one frame with vertcount elements of vertsize bytes.
+    #If components is given each vertex is viewed as that many values of dtype instead, skipping whatever is left of vertsize.
+    if end is None:
+        end = read_anim_header(ANIMFILE)[0]
+    if start < 0 or end < start:
+        raise Exception("Error: Invalid frame range {s}-{e}. Aborting...".format(s=start, e=end))
+    if vertcount*vertsize > framesize:
+        raise Exception("Error: Frame size of the animation file is too small for {v} vertices. Aborting...".format(v=vertcount))
+    if aheadersize + end*framesize > len(ANIMFILE):
+        raise Exception("Error: Animation file is smaller than its frame count says it should be. Aborting...")
+
+    dtype = np.dtype(dtype)
+    if components is None:
+        shape = (end-start, vertcount)
+        strides = (framesize, vertsize)
+    else:
+        shape = (end-start, vertcount, components)
+        strides = (framesize, vertsize, dtype.itemsize)
+
+    return np.ndarray(shape=shape,
+                      dtype=dtype,
+                      buffer=ANIMFILE,
+                      offset=aheadersize + start*framesize,
+                      strides=strides)
+
+
+def decode_unreal_frames (ANIMFILE, vertcount, framesize, SCALE=1, start=0, end=None):
+    #Each vertex is one 32 bit int with X and Y packed in 11 bits (1/8 unit) and Z in 10 bits (1/4 unit).
+    raw = frame_table(ANIMFILE, vertcount, framesize, 4, "<u4", start, end)
+
+    x = (raw & 0x7ff).astype(np.int32)
+    y = ((raw >> 11) & 0x7ff).astype(np.int32)
+    z = ((raw >> 22) & 0x3ff).astype(np.int32)
+
+    coords = np.empty(raw.shape + (3,), dtype=np.float32)
+    coords[..., 0] = ((x ^ 0x400) - 0x400) / 8 * SCALE #Sign extending.
+    coords[..., 1] = ((y ^ 0x400) - 0x400) / 8 * -SCALE #Unreal's Y axis is inverted from Blender's
+    coords[..., 2] = ((z ^ 0x200) - 0x200) / 4 * SCALE
+
+    return coords
+
+
+def decode_ion_frames (ANIMFILE, vertcount, framesize, SCALE=1, start=0, end=None):
+    #Each vertex is three signed 16 bit ints (1/256 unit) followed by a 2 byte pad word.
+    raw = frame_table(ANIMFILE, vertcount, framesize, 8, "<i2", start, end, components=3)
+
+    return (raw / 256 * (SCALE, -SCALE, SCALE)).astype(np.float32) #Unreal's Y axis is inverted from Blender's
+
+
+def decode_frames (ANIMFILE, vertcount, framesize, FORMAT, SCALE=1, start=0, end=None, vertmap=None):
+    #Returns the frames start to end (exclusive) as a (frames, verts, 3) float32 array in Blender's coordinates.
+    #If a vertmap (see split_polys) is given the vertices are returned in that order instead.
+    if FORMAT == "UNREAL":
+        coords = decode_unreal_frames(ANIMFILE, vertcount, framesize, SCALE, start, end)
+    elif FORMAT == "ION":
+        coords = decode_ion_frames(ANIMFILE, vertcount, framesize, SCALE, start, end)
+    else:
+        raise Exception("Error: Unknown animation format {f}. Aborting...".format(f=FORMAT))
+
+    if vertmap is not None:
+        coords = coords[:, vertmap]
+    return coords
+
+
+def quantize (vals, mult, SCALE):
+    #Same as rounding val*mult*SCALE but with anything outside of -128 to 127 (after scaling) clamped to the borders.
+    scaled = vals * SCALE
+    quant = np.round(vals * mult * SCALE)
+    quant[scaled < -128] = -128 * mult
+    quant[scaled > 127] = 127 * mult
+
+    return quant.astype(np.int64)
+
+
+def encode_frame (co, FORMAT, SCALE=1):
+    #Packs one frame of (verts, 3) Blender coordinates into a contiguous array with the _a.3d layout of FORMAT.
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+
+    if FORMAT == "UNREAL":
+        x = quantize(co[:, 0], 8, SCALE) & 0x7ff
+        y = quantize(co[:, 1]*-1, 8, SCALE) & 0x7ff # Unreal's y axis is inverted from Blender's.
+        z = quantize(co[:, 2], 4, SCALE) & 0x3ff
+
+        return (x | (y << 11) | (z << 22)).astype("<u4")
+
+    elif FORMAT == "ION":
+        packed = np.zeros((len(co), 4), dtype="<u2") #Last one is padding.
+        packed[:, 0] = quantize(co[:, 0], 256, SCALE) & 0xffff
+        packed[:, 1] = quantize(co[:, 1]*-1, 256, SCALE) & 0xffff # Unreal's y axis is inverted from Blender's.
+        packed[:, 2] = quantize(co[:, 2], 256, SCALE) & 0xffff
+
+        return packed
+
+    raise Exception("Error: Unknown animation format {f}. Aborting...".format(f=FORMAT))
+
+
+class AnimFile:
+    #Read-only, memory mapped _a.3d file. Only the pages of the frames that are actually accessed get read from disk.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: #Empty files can't be mapped.
+            self.buffer = b""
+
+        try:
+            self.numframes, self.framesize = read_anim_header(self.buffer)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def frames(self, start=0, end=None):
+        #Zero-copy (frames, framesize) view of the raw frame data.
+        if end is None:
+            end = self.numframes
+        return frame_table(self.buffer, 1, self.framesize, self.framesize, "u1", start, end, components=self.framesize)[:, 0]
+
+    def frame(self, frame):
+        return self.frames(frame, frame+1)[0]
+
+    def decode(self, vertcount, FORMAT, SCALE=1, start=0, end=None, vertmap=None):
+        if end is None:
+            end = self.numframes
+        return decode_frames(self.buffer, vertcount, self.framesize, FORMAT, SCALE, start, end, vertmap)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError: #A frame view is still in use. The map gets closed once that is garbage collected.
+                pass
+        self.buffer = b""
+        self.file.close()
+
+
+class AnimWriter:
+    #Writes an _a.3d file one frame at a time so only a single frame has to be kept in memory.
+    #The frame count in the header isn't known until the end so it gets filled in when the file is closed.
+    def __init__(self, path, framesize):
+        if framesize > 0xffff:
+            raise Exception("Error: Frame size of {s} bytes is too large for the animation format. Reduce the number of vertices. Aborting...".format(s=framesize))
+        self.path = path
+        self.framesize = framesize
+        self.numframes = 0
+        self.file = open(path, "w+b")
+        self.write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_header(self):
+        header = np.zeros(1, dtype=anim_header_dtype)
+        header["numframes"] = self.numframes
+        header["framesize"] = self.framesize
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+
+    def write_frame(self, frame):
+        #frame is one packed frame (see encode_frame), or any other buffer of framesize bytes.
+        frame = memoryview(frame).cast("B")
+        if len(frame) != self.framesize:
+            raise Exception("Error: Number of vertices changed between frames. This is not supported in Unreal Engine's animation format and break animations. Aborting...")
+        if self.numframes == 0xffff:
+            raise Exception("Error: Too many frames for the animation format (max 65535). Aborting...")
+        self.file.write(frame)
+        self.numframes += 1
+
+    def write_frames(self, frames):
+        #frames is a (numframes, framesize) uint8 array, for example AnimFile.frames() of another _a.3d file.
+        if frames.ndim != 2 or frames.shape[1] != self.framesize:
+            raise Exception("Error: Number of vertices changed between frames. This is not supported in Unreal Engine's animation format and break animations. Aborting...")
+        if self.numframes + len(frames) > 0xffff:
+            raise Exception("Error: Too many frames for the animation format (max 65535). Aborting...")
+        self.file.write(np.ascontiguousarray(frames).data)
+        self.numframes += len(frames)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.write_header()
+        self.file.close()
+
+
+#=======================================================================
+# Point cache (.pc2).
+#=======================================================================
+pc2_header_dtype = np.dtype([("signature", "S12"),
+                             ("version", "<i4"),
+                             ("numpoints", "<i4"),
+                             ("startframe", "<f4"),
+                             ("samplerate", "<f4"),
+                             ("numsamples", "<i4")])
+
+chunksize = 1 << 24 #Bytes of decoded frames to keep in memory at a time when streaming.
+
+
+def write_pc2 (afile, path, vertcount, FORMAT, SCALE=1, start=0, end=None, vertmap=None):
+    #Converts the frames start to end (exclusive) of an AnimFile to a .pc2 point cache in a single pass.
+    for done in write_pc2_steps(afile, path, vertcount, FORMAT, SCALE, start, end, vertmap):
+        pass
+
+
+def write_pc2_steps (afile, path, vertcount, FORMAT, SCALE=1, start=0, end=None, vertmap=None):
+    #Generator version of write_pc2. Yields the number of frames written so far after every chunk.
+    if end is None:
+        end = afile.numframes
+    numpoints = vertcount if vertmap is None else len(vertmap)
+
+    header = np.zeros(1, dtype=pc2_header_dtype)
+    header["signature"] = b"POINTCACHE2"
+    header["version"] = 1
+    header["numpoints"] = numpoints
+    header["samplerate"] = 1
+    header["numsamples"] = end-start
+
+    step = max(1, chunksize // max(1, numpoints*12))
+    with open(path, "wb") as pc2:
+        pc2.write(header.tobytes())
+        for frame in range(start, end, step):
+            pc2.write(afile.decode(vertcount, FORMAT, SCALE, frame, min(frame+step, end), vertmap).astype("<f4", copy=False).tobytes())
+            yield min(frame+step, end) - start
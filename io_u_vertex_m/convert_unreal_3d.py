@@ -0,0 +1,222 @@
+#   V1.4.0
+#   Command line converter for _d.3d/_a.3d pairs. Doesn't need Blender:
+#       python -m io_u_vertex_m.convert_unreal_3d --to obj --out Preview UnrealTournament/Models DeusEx/Models
+#   Every mesh found in the given files and folders is converted by a pool of processes.
+#   obj, glb and ply write one file per frame. pc2 writes a point cache of all frames plus an .obj of the first frame to apply it to.
+#   obj and glb are Y up, ply and pc2 are Z up like meshes imported into Blender.
+import os
+import io
+import sys
+import json
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from . import codec_unreal_3d
+
+
+def find_meshes (paths):
+    #Returns (data file, animation file) of every mesh in paths, which can be folders (searched recursively) or single files of a mesh.
+    meshes = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                lower = {f.lower(): f for f in files} #Files from old archives don't have consistent case.
+                for f in sorted(files):
+                    if f.lower().endswith("_d.3d"):
+                        anim = lower.get(f.lower()[:-5] + "_a.3d")
+                        if anim is not None:
+                            meshes.append((os.path.join(root, f), os.path.join(root, anim)))
+        elif path[-5:].lower() in ("_d.3d", "_a.3d"):
+            meshes.append((path[:-5] + "_d.3d", path[:-5] + "_a.3d"))
+        else:
+            meshes.append((os.path.splitext(path)[0] + "_d.3d", os.path.splitext(path)[0] + "_a.3d"))
+
+    return meshes
+
+
+#=======================================================================
+# Writers. co is (vertices, 3) in Blender space, one polygon per 3 loops.
+#=======================================================================
+def y_up (co):
+    return np.stack((co[:, 0], co[:, 2], -co[:, 1]), axis=1)
+
+
+def obj_faces (loopverts, uvs, groups):
+    #Everything in an .obj besides the vertex positions, which is the same for every frame.
+    out = io.StringIO()
+    np.savetxt(out, uvs, fmt="vt %.6f %.6f")
+    corners = np.arange(len(loopverts), dtype=np.int64).reshape(-1, 3)
+    for name, polys in groups:
+        out.write("usemtl {n}\n".format(n=name))
+        face = np.empty((len(polys), 6), dtype=np.int64)
+        face[:, 0::2] = loopverts.reshape(-1, 3)[polys] + 1
+        face[:, 1::2] = corners[polys] + 1
+        np.savetxt(out, face, fmt="f %d/%d %d/%d %d/%d")
+    return out.getvalue()
+
+
+def write_obj (path, co, faces):
+    with open(path, "w", encoding="utf-8") as f:
+        np.savetxt(f, y_up(co), fmt="v %.6f %.6f %.6f")
+        f.write(faces)
+
+
+def ply_faces (loopverts):
+    table = np.empty(len(loopverts)//3, dtype=[("count", "u1"), ("vertices", "<i4", 3)])
+    table["count"] = 3
+    table["vertices"] = loopverts.reshape(-1, 3)
+    return table.tobytes()
+
+
+def write_ply (path, co, faces):
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              "element vertex {v}\nproperty float x\nproperty float y\nproperty float z\n"
+              "element face {f}\nproperty list uchar int vertex_indices\nend_header\n").format(v=len(co), f=len(faces)//13)
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(co.astype("<f4").tobytes())
+        f.write(faces)
+
+
+def write_glb (path, name, co, loopverts, uvs, groups):
+    #Binary glTF without indices. Every material is its own primitive over a contiguous run of corners.
+    order = np.concatenate([polys for mtname, polys in groups])
+    corners = (order[:, None]*3 + np.arange(3)).ravel()
+    positions = y_up(co)[loopverts[corners]].astype("<f4")
+    texcoords = uvs[corners].astype("<f4")
+    texcoords[:, 1] = 1 - texcoords[:, 1] #glTF has the origin at the top left.
+
+    binary = positions.tobytes() + texcoords.tobytes()
+    accessors = []
+    primitives = []
+    materials = []
+    start = 0
+    for mtname, polys in groups:
+        count = len(polys)*3
+        block = positions[start:start+count]
+        accessors.append({"bufferView": 0, "byteOffset": start*12, "componentType": 5126, "count": count, "type": "VEC3",
+                          "min": block.min(axis=0).tolist(), "max": block.max(axis=0).tolist()})
+        accessors.append({"bufferView": 1, "byteOffset": start*8, "componentType": 5126, "count": count, "type": "VEC2"})
+        primitives.append({"attributes": {"POSITION": len(accessors)-2, "TEXCOORD_0": len(accessors)-1}, "material": len(materials), "mode": 4})
+        materials.append({"name": mtname, "doubleSided": "_2SIDED" in mtname})
+        start += count
+
+    gltf = {"asset": {"version": "2.0", "generator": "io_u_vertex_m"},
+            "scene": 0, "scenes": [{"nodes": [0]}], "nodes": [{"mesh": 0, "name": name}],
+            "meshes": [{"name": name, "primitives": primitives}], "materials": materials, "accessors": accessors,
+            "bufferViews": [{"buffer": 0, "byteOffset": 0, "byteLength": len(positions)*12, "target": 34962},
+                            {"buffer": 0, "byteOffset": len(positions)*12, "byteLength": len(texcoords)*8, "target": 34962}],
+            "buffers": [{"byteLength": len(binary)}]}
+    text = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    text += b" " * (-len(text) % 4)
+    binary += b"\0" * (-len(binary) % 4)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(text) + 8 + len(binary)))
+        f.write(struct.pack("<II", len(text), 0x4E4F534A))
+        f.write(text)
+        f.write(struct.pack("<II", len(binary), 0x004E4942))
+        f.write(binary)
+
+
+#=======================================================================
+# Converting.
+#=======================================================================
+def convert_mesh (datapath, animpath, outdir, TO, FORMAT="AUTO", SCALE=1, DUPES="DROP", START=1, END=0):
+    #Converts one mesh. START and END are frame numbers starting at 1 like in the importer, END 0 is the last frame.
+    #Returns the number of converted frames.
+    name = os.path.basename(datapath)[:-5]
+    with open(datapath, "rb") as dfile:
+        polycount, vertcount, polys = codec_unreal_3d.read_data(dfile.read())
+    polys, vertindex, vertmap = codec_unreal_3d.clean_polys(polys, vertcount, DUPES)[:3]
+
+    loopverts = codec_unreal_3d.loop_vertices(vertindex)
+    uvs = codec_unreal_3d.loop_uvs(polys)
+    pairs, inverse = np.unique((polys["texnum"].astype(np.uint16) << 8) | polys["polyflags"], return_inverse=True)
+    inverse = inverse.ravel()
+    groups = [(codec_unreal_3d.material_name(int(pair) >> 8, int(pair) & 0xFF, name), np.flatnonzero(inverse == i)) for i, pair in enumerate(pairs)]
+
+    os.makedirs(outdir, exist_ok=True)
+    with codec_unreal_3d.AnimFile(animpath) as afile:
+        if FORMAT == "AUTO":
+            FORMAT = codec_unreal_3d.detect_format(afile.framesize, vertcount)
+            if FORMAT is None:
+                raise Exception("Error: Unable to detect animation format. Aborting...")
+
+        start = min(max(START, 1), afile.numframes) - 1
+        end = afile.numframes if END == 0 or END > afile.numframes else max(END, start+1)
+
+        if TO == "pc2":
+            codec_unreal_3d.write_pc2(afile, os.path.join(outdir, name + ".pc2"), vertcount, FORMAT, SCALE, start, end, vertmap)
+            write_obj(os.path.join(outdir, name + ".obj"), afile.decode(vertcount, FORMAT, SCALE, start, start+1, vertmap)[0], obj_faces(loopverts, uvs, groups))
+            return end-start
+
+        if TO == "obj":
+            faces = obj_faces(loopverts, uvs, groups)
+        elif TO == "ply":
+            faces = ply_faces(loopverts)
+
+        numpoints = vertcount if vertmap is None else len(vertmap)
+        step = max(1, codec_unreal_3d.chunksize // max(1, numpoints*12))
+        for first in range(start, end, step):
+            frames = afile.decode(vertcount, FORMAT, SCALE, first, min(first+step, end), vertmap)
+            for i, co in enumerate(frames):
+                path = os.path.join(outdir, "{n}_{f:04d}.{e}".format(n=name, f=first+i+1, e=TO))
+                if TO == "obj":
+                    write_obj(path, co, faces)
+                elif TO == "ply":
+                    write_ply(path, co, faces)
+                else:
+                    write_glb(path, name, co, loopverts, uvs, groups)
+
+    return end-start
+
+
+def convert_job (args):
+    #Runs in the worker processes. Errors are returned instead of raised so one broken mesh doesn't stop the rest.
+    try:
+        return args[0], convert_mesh(*args), None
+    except Exception as e:
+        return args[0], 0, str(e)
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog="python -m io_u_vertex_m.convert_unreal_3d",
+                                     description="Convert Unreal Engine 1 vertex meshes (_d.3d/_a.3d) to other formats without Blender.")
+    parser.add_argument("paths", nargs="+", help="Folders to search for meshes, or _d.3d/_a.3d files")
+    parser.add_argument("--out", required=True, help="Output folder. Every mesh gets a subfolder named after it, keeping the folder structure of the input")
+    parser.add_argument("--to", choices=("obj", "glb", "ply", "pc2"), default="obj")
+    parser.add_argument("--format", choices=("AUTO", "UNREAL", "ION"), default="AUTO", help="Animation format")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--dupes", choices=("DROP", "SPLIT"), default="DROP", help="What to do with polygons that use the same vertices as another polygon")
+    parser.add_argument("--start", type=int, default=1, help="First frame")
+    parser.add_argument("--end", type=int, default=0, help="Last frame. 0 for all frames")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of processes")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for datapath, animpath in find_meshes(args.paths):
+        base = next((p for p in args.paths if os.path.isdir(p) and os.path.commonpath([os.path.abspath(p), os.path.abspath(datapath)]) == os.path.abspath(p)), None)
+        rel = os.path.relpath(os.path.dirname(datapath), base) if base is not None else ""
+        outdir = os.path.normpath(os.path.join(args.out, rel, os.path.basename(datapath)[:-5]))
+        jobs.append((datapath, animpath, outdir, args.to, args.format, args.scale, args.dupes, args.start, args.end))
+
+    failed = 0
+    frames = 0
+    with ProcessPoolExecutor(max(args.jobs, 1)) as pool:
+        for datapath, count, error in pool.map(convert_job, jobs, chunksize=max(1, len(jobs) // (max(args.jobs, 1)*8))):
+            if error is not None:
+                print ("Failed to convert {f}: {e}".format(f=datapath, e=error))
+                failed += 1
+            else:
+                frames += count
+
+    print ("Converted {n} meshes ({f} frames). {e} failed.".format(n=len(jobs)-failed, f=frames, e=failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,17 @@ import bpy
 import bmesh
 import os
 import ntpath
+import hashlib
+import json
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from . import codec_unreal_3d, skin_unreal_3d, timing_unreal_3d, progress_unreal_3d
+
+timer = timing_unreal_3d.Timer("export") #Timing of the current export. See timing_unreal_3d.
+progress = progress_unreal_3d.Progress() #Progress of the current export. Reports nothing until write_files sets it up.
+memory = [] #Resident memory of the process after every exported action, see save_steps.
 
 
 #=======================================================================
@@ -25,71 +36,339 @@ polyflags =  (("_UNLIT", "_UL", 16),
 
 
 
-#print (baseob.data.vertices[0].co)
+def eval_coords (co):
+    #Reads the vertex positions of the evaluated mesh into co. The evaluated mesh is freed again right away so they don't pile up during long exports.
+    obeval = baseob.evaluated_get(dgraph)
+    animmesh = obeval.to_mesh()
+    try:
+        if len(animmesh.vertices)*3 != len(co):
+            raise Exception ("Error: Number of vertices changed between frames. This is not supported in Unreal Engine's animation format and break animations. Aborting...")
+        animmesh.vertices.foreach_get("co", co)
+    finally:
+        obeval.to_mesh_clear()
+        
+        
+def range2anim (range_min, range, FORMAT, SCALE, writer, co, skin=None, cache=None):
+    #Evaluates every frame in range and writes it to writer (AnimWriter) right away.
+    #co is the coordinate buffer (vertcount*3 float32) that gets reused for every frame.
+    #If a skin (skin_unreal_3d.ArmatureSkin) is given the frames are skinned directly instead of evaluating the scene.
+    #If cache (AnimWriter) is given the frames are also written to it.
+    #Yields after every frame.
+    Fmax = 0
+    vertcount = len(co)//3
+    for frame in range:
+        if skin is not None:
+            with timer.span("armature skinning", vertcount):
+                skin.evaluate(range_min+Fmax, co)
+            Fmax += 1
+        else:
+            with timer.span("depsgraph evaluation", vertcount):
+                evalscene.frame_set (range_min+Fmax)
+                Fmax += 1
+                eval_coords(co)
+            
+        with timer.span("packing", vertcount):
+            frame = codec_unreal_3d.encode_frame(co, FORMAT, SCALE) #One packed buffer per frame.
+        with timer.span("write", vertcount):
+            writer.write_frame (frame)
+            if cache is not None:
+                cache.write_frame (frame)
+        progress.step()
+        yield
+ 
+    else:
+        evalscene.frame_set(range_min)
 
-def corcoords (val, mult, SCALE):
-    if val * SCALE < -128: 
-        return -128 * mult
-    if val * SCALE > 127: 
-        return 127 * mult
-    
-    return int(round(val * mult * SCALE, 0))
+#=======================================================================
+# Isolated evaluation.
+#=======================================================================
+def id_objects (value):
+    #Objects referenced by an ID property value (Object or Collection).
+    if isinstance(value, bpy.types.Object):
+        return [value]
+    if isinstance(value, bpy.types.Collection):
+        return list(value.all_objects)
+    return []
 
 
-def range2anim (range_min, range, FORMAT, SCALE):
-    Fmax = 0
-    r2a_out = []
-    vertcount = len(baseob.evaluated_get(dgraph).to_mesh().vertices)
-    for frame in range:
-        bpy.context.scene.frame_set (range_min+Fmax)
-        Fmax += 1
-        
-        animmesh = baseob.evaluated_get(dgraph).to_mesh()
-        
-        if len(animmesh.vertices) != vertcount:
-            raise Exception ("Error: Number of vertices changed between frames. This is not supported in Unreal Engine's animation format and break animations. Aborting...")
+def gather_dependencies (objects):
+    #Every object the given objects need for their evaluation: parents, modifier/constraint targets, driver targets and so on.
+    found = []
+    todo = list(objects)
+    while todo:
+        ob = todo.pop()
+        if ob is None or ob in found:
+            continue
+        found.append(ob)
         
-        if FORMAT == "UNREAL":
-            for verts in animmesh.vertices:
-                co = ((corcoords(verts.co[0], 8, SCALE) & 0x7ff))
+        todo.append(ob.parent)
+        todo.extend(id_objects(ob.instance_collection))
+        for mod in ob.modifiers:
+            for prop in mod.bl_rna.properties:
+                if prop.type == 'POINTER':
+                    todo.extend(id_objects(getattr(mod, prop.identifier)))
+            for key in mod.keys(): #Geometry Nodes inputs.
+                todo.extend(id_objects(mod[key]))
                 
-                co += (((corcoords((verts.co[1]*-1), 8, SCALE) & 0x7ff) << 11)) # Unreal's y axis is inverted from Blender's.
+        constraints = list(ob.constraints)
+        if ob.type == 'ARMATURE':
+            for pb in ob.pose.bones:
+                constraints.extend(pb.constraints)
+        for con in constraints:
+            todo.extend(id_objects(getattr(con, "target", None)))
+            todo.extend(id_objects(getattr(con, "pole_target", None)))
+            for tgt in getattr(con, "targets", ()): #Armature constraint.
+                todo.extend(id_objects(tgt.target))
                 
-                co += ((corcoords(verts.co[2], 4, SCALE) & 0x3ff) << 22)
-                
-                r2a_out.append ((co).to_bytes(4, 'little'))
+        ids = [ob, ob.data]
+        if getattr(ob.data, "shape_keys", None) is not None: #Drivers of corrective shape keys.
+            ids.append(ob.data.shape_keys)
+        for id in ids:
+            if id is None or id.animation_data is None:
+                continue
+            for fcu in id.animation_data.drivers:
+                for var in fcu.driver.variables:
+                    for tgt in var.targets:
+                        todo.extend(id_objects(tgt.id))
+                        
+    return found
+    
+    
+def make_isolated_scene (objects):
+    #Temporary scene containing only the given objects (and what they depend on) so frame changes don't evaluate the rest of the artist's scene.
+    src = bpy.context.scene
+    tmp = bpy.data.scenes.new(".u3d_export")
+    tmp.render.fps = src.render.fps
+    tmp.render.fps_base = src.render.fps_base
+    tmp.frame_start = src.frame_start
+    tmp.frame_end = src.frame_end
+    
+    dependencies = gather_dependencies(objects)
+    for ob in dependencies:
+        tmp.collection.objects.link(ob)
+    print ("Evaluating", len(dependencies), "of", len(src.objects), "objects in the scene.")
+    
+    tmp.frame_set(src.frame_current) #Also builds the depsgraph.
+    return tmp
+    
+    
+#=======================================================================
+# Action cache.
+#=======================================================================
+def hash_floats (h, collection, attr, size):
+    vals = np.empty(len(collection)*size, dtype=np.float32)
+    collection.foreach_get(attr, vals)
+    h.update(vals.tobytes())
+    
+    
+modifier_ui = ("show_expanded", "is_active", "show_in_editmode", "show_on_cage", "show_render", "persistent_uid", "is_override_data") #Modifier properties that don't affect the exported frames.
 
-        elif FORMAT == "ION":
-            for verts in animmesh.vertices:
-                
-                co = ((corcoords(verts.co[0], 256, SCALE) & 0xffff))
-                r2a_out.append ((co).to_bytes(2, 'little'))
-                co = ((corcoords((verts.co[1]*-1), 256, SCALE) & 0xffff)) # Unreal's y axis is inverted from Blender's.
-                r2a_out.append ((co).to_bytes(2, 'little'))
-                co = ((corcoords(verts.co[2], 256, SCALE) & 0xffff))
-                r2a_out.append ((co).to_bytes(2, 'little'))
-                r2a_out.append ((0).to_bytes(2, 'little'))
 
-                #co = ((corcoords(verts.co[0], 256) & 0xffff))
-                
-                #co += (((corcoords((verts.co[1]*-1), 256) & 0xffff) << 16)) # Unreal's y axis is inverted from Blender's.
+def rig_key (FORMAT, SCALE, FAST_ARMATURE):
+    #Hash of everything besides the action that decides what the exported frames look like: format, scale, topology, the base mesh and its deformers.
+    #FAST_ARMATURE is whether the frames are skinned by skin_unreal_3d, which doesn't give the exact same bytes as the depsgraph.
+    #Changes to other things (drivers, constraint targets, other objects' rest positions) aren't picked up. Use a fresh cache folder for those.
+    h = hashlib.sha1()
+    h.update(repr((FORMAT, float(SCALE), bool(FAST_ARMATURE), sorted(ob.name for ob in selobs))).encode())
+    h.update(np.array(baseob.matrix_world, dtype=np.float64).tobytes())
+    
+    loops = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", loops)
+    h.update(np.int64(len(me.vertices)).tobytes())
+    h.update(loops.tobytes())
+    
+    mesh = baseob.data
+    hash_floats(h, mesh.vertices, "co", 3)
+    h.update(repr([[(g.group, g.weight) for g in v.groups] for v in mesh.vertices]).encode())
+    h.update(repr([vg.name for vg in baseob.vertex_groups]).encode())
+    if mesh.shape_keys is not None:
+        for kb in mesh.shape_keys.key_blocks:
+            h.update(repr((kb.name, kb.mute, kb.relative_key.name, kb.vertex_group)).encode())
+            hash_floats(h, kb.data, "co", 3)
+            
+    for mod in baseob.modifiers:
+        settings = [mod.type, mod.name]
+        for prop in mod.bl_rna.properties:
+            #Read-only runtime values (execution_time...) and panel state would change the key without changing the result.
+            if prop.is_readonly or prop.identifier in modifier_ui or prop.type == 'COLLECTION':
+                continue
+            value = getattr(mod, prop.identifier)
+            if prop.type == 'POINTER':
+                settings.append(value.name if isinstance(value, bpy.types.ID) else None)
+            elif isinstance(value, set): #Enum flags. Sets don't have a fixed order.
+                settings.append(sorted(value))
+            elif getattr(prop, "is_array", False):
+                settings.append(list(value))
+            else:
+                settings.append(value)
+        h.update(repr(settings).encode())
+        
+        if mod.type == 'ARMATURE' and mod.object is not None and mod.object.type == 'ARMATURE':
+            h.update(np.array(mod.object.matrix_world, dtype=np.float64).tobytes()) #Moving the rig relative to the mesh changes the deformation.
+            for bone in mod.object.data.bones:
+                h.update(repr((bone.name, bone.parent.name if bone.parent else None, bone.use_deform, bone.bbone_segments, [list(r) for r in bone.matrix_local])).encode())
                 
-                #co += ((corcoords(verts.co[2], 256) & 0xffff) << 32)
+    return h.digest()
+    
+    
+def action_key (rigkey, action, range_min, range_max):
+    #Hash of an action's fcurves on top of rig_key. Returns None for actions that can't be cached.
+    h = hashlib.sha1(rigkey)
+    h.update(repr((range_min, range_max)).encode())
+    for fcu in action.fcurves:
+        if len(fcu.modifiers): #Too many settings to hash reliably.
+            return None
+        h.update(repr((fcu.data_path, fcu.array_index, fcu.mute, fcu.extrapolation)).encode())
+        kps = fcu.keyframe_points
+        hash_floats(h, kps, "co", 2)
+        hash_floats(h, kps, "handle_left", 2)
+        hash_floats(h, kps, "handle_right", 2)
+        h.update(repr([(kp.interpolation, kp.easing, kp.back, kp.amplitude, kp.period) for kp in kps]).encode())
+    return h.hexdigest()
+    
+    
+def read_cached (path, tot_frames, framesize):
+    #Frames of a cached action, or None if there is no usable cache file.
+    if not os.path.isfile(path):
+        return None
+    try:
+        afile = codec_unreal_3d.AnimFile(path)
+    except Exception:
+        return None
+    if afile.numframes != tot_frames or afile.framesize != framesize:
+        afile.close()
+        return None
+    return afile
+    
+    
+#=======================================================================
+# Parallel export.
+#=======================================================================
+def action_frames (action):
+    #Number of frames exported for an action. Used for dividing the work, so it doesn't have to be exact.
+    return max(int(action.frame_range[1]+1) - int(action.frame_range[0]), 1)
+    
+    
+def split_actions (count):
+    #Splits the exported actions into count lists of about the same number of frames. The order is kept so the segments can simply be joined.
+    actions = [a for a in expactions if len(a.fcurves)]
+    frames = [action_frames(a) for a in actions]
+    total = sum(frames)
+    
+    chunks = [[] for i in range(count)]
+    done = 0
+    for action, tot_frames in zip(actions, frames):
+        chunks[min(done * count // max(total, 1), count-1)].append(action.name)
+        done += tot_frames
+    return [c for c in chunks if c]
+    
+    
+def prep_anim_parallel (writer, FORMAT, SCALE, FAST_ARMATURE, ISOLATE, CACHEDIR, WORKERS):
+    #Exports the actions with WORKERS background Blender processes, each evaluating its own share of the actions from a copy of the .blend file.
+    #Generator with the same return values as prep_anim.
+    chunks = split_actions(WORKERS)
+    if len(chunks) < 2:
+        return (yield from prep_anim(writer, "ACTIONS", FORMAT, SCALE, FAST_ARMATURE, CACHEDIR))
+    
+    tmpdir = tempfile.mkdtemp(prefix="u3d_export_")
+    workers = []
+    try:
+        blendpath = os.path.join(tmpdir, "export.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blendpath, copy=True, check_existing=False) #Also has all the unsaved changes.
+        
+        package = os.path.dirname(os.path.abspath(__file__))
+        expr = ("import sys; sys.path.insert(0, {p!r}); "
+                "from {m}.export_unreal_3d import export_worker; export_worker(sys.argv[sys.argv.index('--')+1])").format(p=os.path.dirname(package), m=os.path.basename(package))
+        
+        for i, chunk in enumerate(chunks):
+            segment = os.path.join(tmpdir, "segment{i}.3d".format(i=i))
+            argpath = segment + ".json"
+            with open (argpath, 'w', encoding = 'utf-8') as f:
+                json.dump({"object": baseob.name, "selected": [ob.name for ob in selobs],
+                           "actions": chunk, "format": FORMAT, "scale": SCALE, "fast_armature": FAST_ARMATURE,
+                           "isolate": ISOLATE, "cachedir": CACHEDIR, "segment": segment, "framesize": writer.framesize}, f)
                 
-                #r2a_out.append ((co).to_bytes(6, 'little'))               
-                #r2a_out.append ((0).to_bytes(2, 'little'))
-         
- 
-    else:
-        bpy.context.scene.frame_set(range_min)
-        return r2a_out
-
+            cmd = [bpy.app.binary_path, "-b", blendpath]
+            if bpy.context.preferences.filepaths.use_scripts_auto_execute:
+                cmd.append("--enable-autoexec") #Drivers with Python expressions.
+            cmd += ["--python-exit-code", "1", "--python-expr", expr, "--", argpath]
+            
+            log = open (segment + ".log", 'w+b')
+            workers.append((subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT), log, segment))
+        print ("Exporting {n} actions with {w} workers...".format(n=sum(len(c) for c in chunks), w=len(workers)))
+        
+        #Frames written so far can be seen from the size of the segments.
+        while any(proc.poll() is None for proc, log, segment in workers):
+            written = 0
+            for proc, log, segment in workers:
+                if os.path.exists(segment):
+                    written += max(os.path.getsize(segment) - codec_unreal_3d.aheadersize, 0) // writer.framesize
+            progress.update(written)
+            yield 0.05 #Nothing to do but wait, see progress_unreal_3d.run_steps.
+            
+        failed = []
+        for i, (proc, log, segment) in enumerate(workers):
+            proc.wait()
+            log.seek(0)
+            output = log.read().decode('utf-8', 'replace')
+            log.close()
+            if proc.returncode != 0:
+                print (output[-4000:])
+                failed.append(i)
+        if failed:
+            raise Exception("Error: Export worker {w} failed (see the console). Aborting...".format(w=", ".join(str(i) for i in failed)))
+            
+        ucdata = []
+        ucframe = 0
+        for proc, log, segment in workers:
+            with open (segment + ".uc.json", 'r', encoding = 'utf-8') as f:
+                segdata = json.load(f)
+            with codec_unreal_3d.AnimFile(segment) as afile:
+                writer.write_frames(afile.frames())
+            for name, tot_frames in segdata:
+                ucdata.append ([name, ucframe, tot_frames])
+                ucframe += tot_frames
+        return ucdata, ucframe
+    finally:
+        for proc, log, segment in workers:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            log.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        
+        
+def export_worker (argpath):
+    #Runs inside a background Blender process started by prep_anim_parallel. Writes the given actions to a segment file and their frame counts to a .uc.json next to it.
+    with open (argpath, 'r', encoding = 'utf-8') as f:
+        args = json.load(f)
+        
+    view_layer = bpy.context.view_layer
+    for ob in view_layer.objects:
+        ob.select_set(ob.name in args["selected"])
+    view_layer.objects.active = bpy.data.objects[args["object"]]
+    
+    global dgraph
+    global evalscene
+    baseeval = prep_base()
+    if len(me.vertices) * (4 if args["format"] == "UNREAL" else 8) != args["framesize"]:
+        raise Exception("Error: Mesh in the export worker doesn't match the exported mesh. Aborting...")
+        
+    if args["isolate"]:
+        evalscene = make_isolated_scene([baseob] + selobs)
+        dgraph = evalscene.view_layers[0].depsgraph
+        
+    with codec_unreal_3d.AnimWriter(args["segment"], args["framesize"]) as a:
+        ucdata, ucframe = progress_unreal_3d.run_steps(prep_anim(a, "ACTIONS", args["format"], args["scale"], args["fast_armature"], args["cachedir"], args["actions"]))
+        
+    with open (args["segment"] + ".uc.json", 'w', encoding = 'utf-8') as f:
+        json.dump([(name, tot_frames) for name, ucst, tot_frames in ucdata], f)
+    baseeval.to_mesh_clear()
+    
+    
 def prep_data ():
-    data = []
-    meshcolor = (0).to_bytes(1, 'little') #unused
+    #Returns the whole polygon table as one structured array (see codec_unreal_3d.poly_dtype).
     texnum = 0
-    unusedflags = (0).to_bytes(1, 'little') #unused
-    mnlist = []
     mattdata = []
     texdata = []
     notex = ""
@@ -126,80 +405,61 @@ def prep_data ():
         
     if mattdata == []:
         mattdata = [[0, 0]] #For when no materials are assigned.
+    mattdata = np.array(mattdata, dtype=np.uint8)
+    
+    polycount = len(me.polygons)
+    loop_start = np.empty(polycount, dtype=np.int32)
+    me.polygons.foreach_get("loop_start", loop_start)
+    loops = loop_start[:, None] + np.arange(3, dtype=np.int32) #Mesh is triangulated so every polygon has 3 loops.
+    
+    loopverts = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", loopverts)
+    
+    mi = np.empty(polycount, dtype=np.int32)
+    me.polygons.foreach_get("material_index", mi)
+    
+    uvs = None
+    if me.uv_layers.active != None: #reading uvs.
+        uvs = np.empty(len(me.loops)*2, dtype=np.float32)
+        me.uv_layers.active.data.foreach_get("uv", uvs)
+        uvs = uvs.reshape(-1, 2)[loops]
+    elif polycount:
+        #print ("Model has no UV data: Setting LODNOTEX=True for .uc file.")
+        notex = "LODNOTEX=True"
         
-    for polys in me.polygons:
-        
-        v = []
-        uv = []
-        meshtype = 0
-        
-        mi = polys.material_index
-        
-        texnum = (mattdata[mi][0]).to_bytes(1, 'little')
-                
-        meshtype = (mattdata[mi][1]).to_bytes(1, 'little')
-        
-        
-        for i in polys.loop_indices: #reading uvs.
-            if me.uv_layers.active != None:
-                uvl = me.uv_layers.active
-                #for n, uvl in enumerate(me.uv_layers):
-                tempuv = [int((uvl.data[me.loops[i].index].uv[0]+(1/255))*255), #add offset of 1 pixel 
-                abs(int(uvl.data[me.loops[i].index].uv[1]*255)-255)] #Unreal V coords are the inverse of Blender's
-                #tempuv = [int(round((uvl.data[me.loops[i].index].uv[0]*256))), 
-                #          int(round((uvl.data[me.loops[i].index].uv[1]*-256)))] #Unreal V coords are the inverse of Blender's
-                for i, i2 in enumerate (tempuv):
-                    if i2 < 0:
-                        tempuv[i] = 0
-                    if i2 > 255:
-                        tempuv[i] = 255
-                                
-            else: 
-                tempuv = [0,0]                    
-            uv.append ([(tempuv[0]).to_bytes(1, 'little'), (tempuv[1]).to_bytes(1, 'little')])
-            
-            
-        for verts in polys.vertices:
-            v.append((verts).to_bytes(2, 'little'))
-            #print (me.vertices[verts].co)
-
-            #uv.append(int(me.uv_layers.active.data[verts].uv[0]*255).to_bytes(1, 'little'))
-            #uv.append(int(me.uv_layers.active.data[verts].uv[1]*255).to_bytes(1, 'little'))
-
-            
-        else:
-
-            data.append(v[0])
-            data.append(v[2])
-            data.append(v[1])
-            data.append(meshtype)
-            data.append(meshcolor)
-            if uv != []:
-                data.extend(uv[0])
-                data.extend(uv[2])
-                data.extend(uv[1])
-            else:
-                #print ("Model has no UV data: Adding Padding data and setting LODNOTEX=True for .uc file.")
-                data.extend([(0).to_bytes(3, 'little')])
-                notex = "LODNOTEX=True"
-                
-            data.append(texnum)
-            data.append(unusedflags)
-            
-            
-    else:
-        return data, texdata, notex
+    data = codec_unreal_3d.encode_polys(loopverts[loops], mattdata[mi, 0], mattdata[mi, 1], uvs)
     
+    return data, texdata, notex
     
-def prep_anim (ANIMSOURCE, FORMAT, SCALE):
+    
+def prep_anim (writer, ANIMSOURCE, FORMAT, SCALE, FAST_ARMATURE=False, CACHEDIR=None, ACTIONS=None):
+    #If CACHEDIR is given, the frames of every action are also stored there and reused on the next export as long as the action and the mesh haven't changed.
+    #ACTIONS is a list of action names to export instead of all of them (used by the export workers).
+    #Generator, see range2anim. Returns ucdata and ucframe.
     ucdata = []
     ucframe = 0
-    anim = []
     
-    print (me.vertices)
+    co = np.empty(len(me.vertices)*3, dtype=np.float32) #Reused for every frame of every action.
+    
+    skin = None
+    if FAST_ARMATURE and ANIMSOURCE == "ACTIONS":
+        skin = skin_unreal_3d.get_skin(baseob)
+        if skin is not None:
+            print ("Mesh is only deformed by an armature. Using fast armature evaluation where possible.")
+    
+    rigkey = None
+    used = set()
+    reused = 0
+    if CACHEDIR is not None and ANIMSOURCE == "ACTIONS":
+        os.makedirs(CACHEDIR, exist_ok=True)
+        rigkey = rig_key(FORMAT, SCALE, skin is not None)
     
     if ANIMSOURCE == "ACTIONS":
-        for action in bpy.data.actions:
+        actions = expactions
+        if ACTIONS is not None:
+            actions = [bpy.data.actions[name] for name in ACTIONS]
+            
+        for action in actions:
             if not len(action.fcurves): #check if action has keyframes. If not then it will be skipped.
                 print ("No keyframes in",action.name,", skipping.")
                 continue
@@ -209,7 +469,7 @@ def prep_anim (ANIMSOURCE, FORMAT, SCALE):
                 single_key_check *= len(fcu.keyframe_points) #Equals 1 if action has only 1 set of keyframes.
                 
             
-            for ob in bpy.context.selected_objects:
+            for ob in selobs:
                 if ob.animation_data == None:
                     raise Exception("Error: One of the selected objects doesn't have animation data. Aborting...")
                 ob.animation_data.action = action
@@ -225,15 +485,53 @@ def prep_anim (ANIMSOURCE, FORMAT, SCALE):
             action_range = range(range_min, range_max)
 
             ucst = ucframe
-
-            r2a_out = range2anim(range_min, action_range, FORMAT, SCALE)
-            anim.extend (r2a_out)     
+            
+            key = None
+            if rigkey is not None:
+                key = action_key(rigkey, action, range_min, range_max)
+            if key is not None:
+                cachepath = os.path.join(CACHEDIR, key + ".3d")
+                used.add(key + ".3d")
+                cached = read_cached(cachepath, tot_frames, writer.framesize)
+                if cached is not None:
+                    with cached:
+                        writer.write_frames(cached.frames())
+                    progress.step(tot_frames)
+                    reused += 1
+                    ucdata.append ([action.name, ucst, tot_frames])
+                    ucframe += tot_frames
+                    memory.append(timing_unreal_3d.memory_usage()[0])
+                    continue
+                cache = codec_unreal_3d.AnimWriter(cachepath + ".tmp", writer.framesize)
+            else:
+                cache = None
+                
+            try:
+                if skin is not None and skin.supports_action(action):
+                    skin.set_action(action)
+                    yield from range2anim(range_min, action_range, FORMAT, SCALE, writer, co, skin, cache)
+                else:
+                    yield from range2anim(range_min, action_range, FORMAT, SCALE, writer, co, cache=cache)
+            except:
+                if cache is not None:
+                    cache.close()
+                    os.remove(cache.path)
+                raise
+            if cache is not None:
+                cache.close()
+                os.replace(cache.path, cachepath) #Only complete actions end up in the cache.
                  
             ucdata.append ([action.name, ucst, tot_frames])
             ucframe += tot_frames
+            memory.append(timing_unreal_3d.memory_usage()[0])
             #print (ucdata)
         else:
-            return anim, ucdata, ucframe
+            if rigkey is not None and ACTIONS is None: #Workers only see part of the actions.
+                for name in os.listdir(CACHEDIR): #Remove actions that were changed or deleted.
+                    if name not in used and (name.endswith(".3d") or name.endswith(".tmp")):
+                        os.remove(os.path.join(CACHEDIR, name))
+                print ("Reused {r} of {n} actions from the cache.".format(r=reused, n=len(ucdata)))
+            return ucdata, ucframe
     elif ANIMSOURCE == "SCENE": #Use scene frames
     
         
@@ -243,40 +541,132 @@ def prep_anim (ANIMSOURCE, FORMAT, SCALE):
         tot_frames = (range_max - range_min)
         
 
-        anim = range2anim(range_min, scene_range, FORMAT, SCALE)
+        yield from range2anim(range_min, scene_range, FORMAT, SCALE, writer, co)
         ucdata = None
         
-        return anim, ucdata, tot_frames
+        return ucdata, tot_frames
+    elif ANIMSOURCE == "STILL": #Batch export of a mesh without an armature. Just the current frame.
+        frame = bpy.context.scene.frame_current
+        yield from range2anim(frame, range(frame, frame+1), FORMAT, SCALE, writer, co)
+        
+        return None, 1
             
   
            
 
 
-def write_files (context, filepath, EXPORT_DATA, EXPORT_ANIM, FORMAT, ANIMSOURCE, SCALE, EXPORT_UC, USE_FOLDERS, MODELDIR, ANIMDIR, UCDIR, TEXDIR, LOD, LODSTYLE, LODFRAME):
-    ucframe = 0
-    ucdata = None
-    texdata = None
-    notex = ""
+def get_rig (ob):
+    #The armature deforming ob: the object of its Armature modifier, or its parent if that's an armature. None if there isn't one.
+    for mod in ob.modifiers:
+        if mod.type == 'ARMATURE' and mod.show_viewport and mod.object is not None and mod.object.type == 'ARMATURE':
+            return mod.object
+    if ob.parent is not None and ob.parent.type == 'ARMATURE':
+        return ob.parent
+    return None
+    
+    
+def rig_actions (rig):
+    #Actions made for rig: the ones animating its bones and the ones it already uses directly or in its NLA tracks.
+    bones = rig.pose.bones
+    used = set()
+    ad = rig.animation_data
+    if ad is not None:
+        used.add(ad.action)
+        for track in ad.nla_tracks:
+            used.update(strip.action for strip in track.strips)
+            
+    actions = []
+    for action in bpy.data.actions:
+        if action in used:
+            actions.append(action)
+            continue
+        for fcu in action.fcurves:
+            match = skin_unreal_3d.bone_path.match(fcu.data_path)
+            if match is not None and bpy.utils.unescape_identifier(match.group(1)) in bones:
+                actions.append(action)
+                break
+    return actions
+    
     
+def prep_base (ob=None):
+    #Sets up the globals used by the rest of the export for ob, or the active object and the selection if not given. Returns the evaluated object to call to_mesh_clear on when done.
+    #For a given ob (batch export) the actions are assigned to the armature deforming it and only the actions made for that armature are exported.
     global baseob 
-    baseob = bpy.context.active_object
+    global selobs #Objects the actions get assigned to.
+    global expactions #Actions exported when exporting actions.
+    global still #Batch export of a mesh without armature or actions. Only a single frame is exported.
+    if ob is None:
+        baseob = bpy.context.active_object
+        selobs = list(bpy.context.selected_objects)
+        expactions = list(bpy.data.actions)
+        still = False
+    else:
+        baseob = ob
+        rig = get_rig(ob)
+        selobs = [rig] if rig is not None else []
+        expactions = rig_actions(rig) if rig is not None else []
+        still = not expactions
+        if rig is not None and rig.animation_data is None:
+            rig.animation_data_create()
     
     global dgraph
     dgraph = bpy.context.evaluated_depsgraph_get()
+    
+    global evalscene
+    evalscene = bpy.context.scene
 
     if baseob.type != 'MESH':
         raise Exception("Error: Selected object is not a mesh. Aborting...")
 
     global me
-    me = baseob.evaluated_get(dgraph).to_mesh()
+    with timer.span("mesh evaluation") as span:
+        baseeval = baseob.evaluated_get(dgraph) #to_mesh_clear has to be called on the same evaluated object to free the mesh.
+        me = baseeval.to_mesh()
+        span.count = len(me.vertices)
 
-    bm = bmesh.new()
-    bm.from_mesh(me)
-    bmesh.ops.triangulate(bm, faces=bm.faces)
-    bm.to_mesh(me)
+    loop_total = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_total", loop_total)
+    ngons = np.flatnonzero(loop_total != 3)
+    if len(ngons): #Game-ready meshes usually are triangles already.
+        with timer.span("triangulation", len(ngons)):
+            bm = bmesh.new()
+            bm.from_mesh(me)
+            bm.faces.ensure_lookup_table()
+            bmesh.ops.triangulate(bm, faces=[bm.faces[i] for i in ngons])
+            bm.to_mesh(me)
+            bm.free()
+    
+    return baseeval
+    
     
+def write_files (*args, **kwargs):
+    progress_unreal_3d.run_steps(write_files_steps(*args, **kwargs))
     
     
+def write_files_steps (context, filepath, EXPORT_DATA, EXPORT_ANIM, FORMAT, ANIMSOURCE, SCALE, EXPORT_UC, USE_FOLDERS, MODELDIR, ANIMDIR, UCDIR, TEXDIR, LOD, LODSTYLE, LODFRAME, FAST_ARMATURE=False, ISOLATE=False, CACHE=False, WORKERS=1, OBJECT=None, TIMING=False, TIMING_PATH=""):
+    #Generator that yields after every exported frame. If it's closed early (cancelled) the unfinished files are removed and the previous export is left as it was.
+    global timer
+    timer = timing_unreal_3d.Timer("export", "", TIMING)
+    baseeval = prep_base(OBJECT)
+    timer.name = baseob.name
+    try:
+        yield from write_mesh_files(filepath, EXPORT_DATA, EXPORT_ANIM, FORMAT, ANIMSOURCE, SCALE, EXPORT_UC, USE_FOLDERS, MODELDIR, ANIMDIR, UCDIR, TEXDIR, LOD, LODSTYLE, LODFRAME, FAST_ARMATURE, ISOLATE, CACHE, WORKERS)
+    finally:
+        baseeval.to_mesh_clear()
+    timer.report(TIMING_PATH)
+    
+    
+def write_mesh_files (filepath, EXPORT_DATA, EXPORT_ANIM, FORMAT, ANIMSOURCE, SCALE, EXPORT_UC, USE_FOLDERS, MODELDIR, ANIMDIR, UCDIR, TEXDIR, LOD, LODSTYLE, LODFRAME, FAST_ARMATURE, ISOLATE, CACHE, WORKERS):
+    #Writes the files of the mesh set up by prep_base. Generator, see write_files_steps.
+    ucframe = 0
+    ucdata = None
+    texdata = None
+    notex = ""
+    
+    global dgraph
+    global evalscene
+    global progress
+    
     datapath = os.path.splitext(filepath)[0] + "_d" + os.path.splitext(filepath)[1] #Data file path.
     if USE_FOLDERS:
         newdir = os.path.join(os.path.split(datapath)[0], MODELDIR)
@@ -298,60 +688,79 @@ def write_files (context, filepath, EXPORT_DATA, EXPORT_ANIM, FORMAT, ANIMSOURCE
         animpath = os.path.join(newdir, os.path.split(animpath)[1])
             
     
-    if EXPORT_DATA:
-        data, texdata, notex = prep_data()
-
-        with open (datapath, 'w+b') as d:
-            print ("Writing {n}...".format(n=datapath))
-            numpolys = (len(me.polygons)).to_bytes(2, 'little')
-            numverts = (len(me.vertices)).to_bytes(2, 'little')
-            unusedrot = (0).to_bytes(2, 'little')
-            unusedframe = (0).to_bytes(2, 'little')
-            unusednormx = (0).to_bytes(4, 'little')
-            unusednormy = (0).to_bytes(4, 'little')
-            unusednormz = (0).to_bytes(4, 'little')
-            unusedscale = (0).to_bytes(4, 'little')
-            genunused = (0).to_bytes(12, 'little')
-            moreunused = (0).to_bytes(12, 'little')
+    #The files are written to .tmp files that only replace the previous export once everything is written, so a failed or cancelled export leaves the old _d.3d/_a.3d pair untouched.
+    written = [] #Paths whose .tmp file has been started.
+    try:
+        if EXPORT_DATA:
+            with timer.span("polygon table", len(me.polygons)):
+                data, texdata, notex = prep_data()
+    
+            written.append(datapath)
+            with open (datapath + ".tmp", 'w+b') as d, timer.span("write", len(me.polygons)):
+                print ("Writing {n}...".format(n=datapath))
+                d.write (codec_unreal_3d.encode_data_header(len(me.polygons), len(me.vertices))) #Write header
+                d.write (data) #Write data
+                    
+                    
+        if EXPORT_ANIM:
+            if FORMAT == "UNREAL":
+                fsize = 4
+            elif FORMAT == "ION":
+                fsize = 8
+            framesize = len(me.vertices) * fsize
             
-            header = [numpolys, 
-                      numverts, 
-                      unusedrot, 
-                      unusedframe, 
-                      unusednormx, 
-                      unusednormy, 
-                      unusednormz, 
-                      unusedscale, 
-                      genunused,
-                      moreunused]
-            for i in header: #Write header
-                d.write (i)
+            if still and ANIMSOURCE == "ACTIONS":
+                ANIMSOURCE = "STILL"
+            parallel = WORKERS > 1 and ANIMSOURCE == "ACTIONS"
+            basescene = evalscene
+            basedgraph = dgraph
+            isolated = None #Only this scene gets removed again. The artist may switch scenes while the modal export runs.
+            if ISOLATE and not parallel: #Workers isolate their own copy.
+                isolated = evalscene = make_isolated_scene([baseob] + selobs)
+                dgraph = evalscene.view_layers[0].depsgraph
             
-            for i in data: #Write data
-                d.write (i)
-            print ("{n} created successfully.".format(n=datapath))
-                
-                
-    if EXPORT_ANIM:
-        anim, ucdata, ucframe = prep_anim(ANIMSOURCE, FORMAT, SCALE)
-        me = baseob.to_mesh() #fixes "structRNA of type Mesh has been removed" error
-        
-        if FORMAT == "UNREAL":
-            fsize = 4
-        elif FORMAT == "ION":
-            fsize = 8
-        
-        with open (animpath, 'w+b') as a:
-            print ("Writing {n}...".format(n=animpath))
-            header = [(ucframe).to_bytes(2, 'little'),
-                      (len(me.vertices) * fsize).to_bytes(2, 'little')]
-            for i in header: #Write header
-                a.write (i)
-                
-            for i in anim: #Write animations
-                a.write (i)
-                
-            print ("{n} created successfully.".format(n=animpath))
+            progress = progress_unreal_3d.Progress(bpy.context.window_manager, bpy.app.background)
+            if ANIMSOURCE == "ACTIONS":
+                progress.begin("Exporting actions", sum(action_frames(a) for a in expactions if len(a.fcurves)))
+            elif ANIMSOURCE == "STILL":
+                progress.begin("Exporting frame", 1)
+            else:
+                progress.begin("Exporting frames", evalscene.frame_end - evalscene.frame_start + 1)
+            
+            try:
+                #Frames are written as soon as they're evaluated. The frame count in the header is filled in when the writer is closed.
+                written.append(animpath)
+                with codec_unreal_3d.AnimWriter(animpath + ".tmp", framesize) as a:
+                    print ("Writing {n}...".format(n=animpath))
+                    cachedir = None
+                    if CACHE:
+                        cachedir = os.path.join(os.path.dirname(animpath), ".u3d_cache", os.path.splitext(os.path.basename(animpath))[0])
+                    if parallel:
+                        with timer.span("export workers"):
+                            ucdata, ucframe = yield from prep_anim_parallel(a, FORMAT, SCALE, FAST_ARMATURE, ISOLATE, cachedir, WORKERS)
+                    else:
+                        ucdata, ucframe = yield from prep_anim(a, ANIMSOURCE, FORMAT, SCALE, FAST_ARMATURE, cachedir)
+            finally:
+                progress.end()
+                if isolated is not None:
+                    frame = isolated.frame_current
+                    bpy.data.scenes.remove(isolated)
+                    evalscene = basescene
+                    dgraph = basedgraph
+                    evalscene.frame_set(frame) #Return to the starting frame of the last exported animation.
+                    
+        from . import import_unreal_3d
+        for path in written:
+            import_unreal_3d.close_streamed_file(path) #A streamed mesh may still have the previous export open.
+            os.replace(path + ".tmp", path)
+            print ("{n} created successfully.".format(n=path))
+    except BaseException as e: #Also when cancelled (GeneratorExit).
+        for path in written:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+        if isinstance(e, GeneratorExit):
+            print ("Export cancelled. The previous files were left unchanged.")
+        raise
                 
                 
     if EXPORT_UC:
@@ -409,11 +818,33 @@ def write_files (context, filepath, EXPORT_DATA, EXPORT_ANIM, FORMAT, ANIMSOURCE
             uc.write ("    Mesh={on}\n".format(on=baseob.name))
             uc.write ("}")
             print ("{n} created successfully.".format(n=ucpath))
-    baseob.to_mesh_clear()
 
 
-def save (operator, context, filepath="", e_anim=False, a_format="UNREAL", a_source="ACTIONS", e_scale=1, e_data=False, e_uc=False, e_to_folders = False, modeldir = "Models", animdir = "Models", classdir = "Classes", texdir = "Textures", lod = True, lod_style = 10, lod_frame = 0):
+def export (context, filepath, ob=None, **keywords):
+    #Exports ob (the active object if None). Takes the same keywords as the export operator.
+    progress_unreal_3d.run_steps(export_steps(context, filepath, ob, **keywords))
+    
+    
+def export_steps (context, filepath, ob=None, e_anim=False, a_format="UNREAL", a_source="ACTIONS", e_scale=1, e_data=False, e_uc=False, e_to_folders = False, modeldir = "Models", animdir = "Models", classdir = "Classes", texdir = "Textures", lod = True, lod_style = 10, lod_frame = 0, e_fast_armature = False, e_isolate = False, e_cache = False, e_workers = 1, timing = False, timing_path = ""):
+    yield from write_files_steps(context, filepath, e_data, e_anim, a_format, a_source, e_scale, e_uc, e_to_folders, modeldir, animdir, classdir, texdir, lod, lod_style, lod_frame, e_fast_armature, e_isolate, e_cache, e_workers, ob, timing, bpy.path.abspath(timing_path) if timing_path else "")
+    
+    
+def save (operator, context, filepath="", **keywords):
+    return progress_unreal_3d.run_steps(save_steps(operator, context, filepath, **keywords))
+    
+    
+def save_steps (operator, context, filepath="", **keywords):
 
-    write_files(context, filepath, e_data, e_anim, a_format, a_source, e_scale, e_uc, e_to_folders, modeldir, animdir, classdir, texdir, lod, lod_style, lod_frame)
+    #Memory of the whole Blender process, so it includes the evaluated meshes. The peak is that of the process, not only of this export.
+    memory.clear()
+    yield from export_steps(context, filepath, **keywords)
+    
+    mb = 1024*1024
+    message = "Peak memory: {m:.0f} MB".format(m=timing_unreal_3d.memory_usage()[1]/mb)
+    samples = [m for m in memory if m is not None]
+    if len(samples) > 1: #Should stay flat from one action to the next.
+        message += ". After the first action: {f:.0f} MB, after the last: {l:.0f} MB".format(f=samples[0]/mb, l=samples[-1]/mb)
+    print (message)
+    operator.report({'INFO'}, message)
                 
     return {'FINISHED'}
@@ -1,139 +1,151 @@
 #   V1.3.5
-import bpy, bmesh, sys, os
+import bpy, os, tempfile
+from bpy.app.handlers import persistent
+import numpy as np
+from . import codec_unreal_3d, timing_unreal_3d, progress_unreal_3d
 
-bDebug = False #print more information (much slower)
+timer = timing_unreal_3d.Timer("import") #Timing of the current import. See timing_unreal_3d.
 
-#Unreal fsize = 4
-#DX dsize = 8
 
-#Constants:
-polysize = 16
-dheadersize = 48
-
-aheadersize = 4
-def ofprint (var, sep, var2):
-    if bDebug:
-        out = "%d %s %d" % (var, sep, var2)
-        sys.stdout.write('\r' + ' '*len(out))
-        sys.stdout.write('\r')
-        sys.stdout.flush()
-        sys.stdout.write(out)
-        sys.stdout.flush() 
-            
-def unsign (i):
-    if i >= 128:
-        return i - 256      
-    else:
+def assign_materials (texnum, polyflags, ob, name):
+    #Returns the material slot for this texnum and polyflags combination. Reuses the material if it already exists.
+    mtname = codec_unreal_3d.material_name(texnum, polyflags, name)
+    
+    i = ob.data.materials.find(mtname)
+    if i != -1:
         return i
     
-#Data file:            
-def get_data_header (DATAFILE):
-    #Header
-    polycount = int.from_bytes(DATAFILE[0:2], 'little')
-    vertcount = int.from_bytes(DATAFILE[2:4], 'little')
-    unusedrot = int.from_bytes(DATAFILE[4:6], 'little')
-    unusedframe = int.from_bytes(DATAFILE[6:8], 'little')
-    unusednormx = int.from_bytes(DATAFILE[8:12], 'little')
-    unusednormy = int.from_bytes(DATAFILE[12:16], 'little')
-    unusednormz = int.from_bytes(DATAFILE[16:20], 'little')
-    unusedscale = int.from_bytes(DATAFILE[20:24], 'little')
-    genunused = int.from_bytes(DATAFILE[24:36], 'little')
-    moreunused = int.from_bytes(DATAFILE[36:48], 'little')
-    
-    return polycount, vertcount
-
+    mt = bpy.data.materials.get(mtname)
+    if mt is None:
+        mt = bpy.data.materials.new(mtname)
+    ob.data.materials.append(mt)
+        
+    return len(ob.data.materials)-1
     
-def get_data_polys (DATAFILE, pi):
-    vertindex = []
-    for i in range(3):
-        vertindex.append(int.from_bytes(DATAFILE[dheadersize+(polysize*pi)+(i*2):dheadersize+(polysize*pi)+(i*2)+2], 'little'))
     
-    polyflags = DATAFILE[dheadersize+(polysize*pi+6)]
-    meshcolor = DATAFILE[dheadersize+(polysize*pi+7)] #unused
+def assign_all_materials (polys, ob, name):
+    #Every distinct (texnum, polyflags) pair only gets looked up once. Material slots are added in the order the pairs first appear in the polygon table.
+    pairs, first, inverse = np.unique((polys["texnum"].astype(np.uint16) << 8) | polys["polyflags"], return_index=True, return_inverse=True)
     
-    uvs = []
-    for v in range(3): #Vertices
-        tempuvs = []
-        for uv in range(2): #uvs
-            tempuvs.append(DATAFILE[dheadersize+(polysize*pi)+8+(v*2)+uv])
-        uvs.append(tempuvs)
+    slots = np.zeros(len(pairs), dtype=np.int32)
+    for p in np.argsort(first):
+        pair = int(pairs[p])
+        slots[p] = assign_materials(pair >> 8, pair & 0xFF, ob, name)
         
-    texnum = DATAFILE[dheadersize+(polysize*pi+14):dheadersize+(polysize*pi+15)]
-    unusedflags = DATAFILE[dheadersize+(polysize*pi+15):dheadersize+(polysize*pi+16)]
+    ob.data.polygons.foreach_set("material_index", slots[inverse.ravel()])
     
-    return vertindex, polyflags, uvs, texnum
     
+#Streamed animation:
+streamed_files = {} #Open AnimFiles of streamed meshes and the os.stat they were opened with by path. These stay open so frame changes only have to decode a single frame.
+stream_errors = {} #Last error printed for every streamed mesh, so it isn't printed again on every frame change.
 
-def assign_materials (texnum, polyflags, ob, name):
-    mtname = str(int.from_bytes(texnum, 'little'))
-    mtname = ("0"*(3-len(mtname)))+mtname
-    
-    if (polyflags & 0xF) == 1: mtname+="_2SIDED"
-    elif (polyflags & 0xF) == 2: mtname+="_TRANSLUCENT"
-    elif (polyflags & 0xF) == 3: mtname+="_MASKED"
-    elif (polyflags & 0xF) == 4: mtname+="_MODULATED"
-    elif (polyflags & 0xF) == 5: mtname+="_ALPHABLEND"
-    elif (polyflags & 0xF) == 8: mtname+="_WEAPONTRI"
-    else: mtname+="_NORMAL"
-    
-    if ((polyflags >> 4) & 0x1) == 1: mtname+="_UNLIT"
-    if ((polyflags >> 5) & 0x1) == 1: mtname+="_FLAT"
-    if ((polyflags >> 6) & 0x1) == 1: mtname+="_ENVIRONMENT"
-    if ((polyflags >> 7) & 0x1) == 1: mtname+="_NOSMOOTH"
-    
-    mtname+="_"
-    mtname+=name
-    
-    
-    if mtname in ob.data.materials:
-        i = 0
-        for m in ob.data.materials:
-            if m.name == mtname:
-                break
-            i+=1
-        return i
+def get_streamed_file (path):
+    #Reopens the file if it was changed since it was opened (re-exported over), otherwise the old frames would keep playing.
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+    afile, opened = streamed_files.get(path, (None, None))
+    if afile is not None and opened != stamp:
+        afile.close()
+        afile = None
+    if afile is None:
+        afile = codec_unreal_3d.AnimFile(path)
+        streamed_files[path] = (afile, stamp)
+    return afile
+    
+    
+def close_streamed_file (path):
+    #Files can't be replaced while they're mapped on Windows. The exporter closes the file before writing over it, the next frame change opens it again.
+    for key in [k for k in streamed_files if os.path.normcase(os.path.abspath(k)) == os.path.normcase(os.path.abspath(path))]:
+        streamed_files.pop(key)[0].close()
+        
+        
+def close_streamed_files ():
+    for afile, opened in streamed_files.values():
+        afile.close()
+    streamed_files.clear()
+    
+    
+@persistent
+def stream_frame (scene, depsgraph=None):
+    #frame_change_post handler. Writes the current frame of every streamed mesh into its vertices.
+    for ob in scene.objects:
+        if ob.type != 'MESH' or "u3d_stream" not in ob:
+            continue
+        stream = ob["u3d_stream"]
+        path = bpy.path.abspath(stream["path"])
+        vertmap = None
+        if len(stream.get("split", [])):
+            vertmap = np.concatenate((np.arange(stream["vertcount"]), np.array(stream["split"], dtype=np.int64)))
+        
+        try:
+            afile = get_streamed_file(path)
+            frame = min(max(scene.frame_current, 0), stream["end"]-stream["start"]-1) + stream["start"]
+            coords = afile.decode(stream["vertcount"], stream["format"], stream["scale"], frame, frame+1, vertmap)[0]
+            ob.data.vertices.foreach_set("co", coords.ravel())
+        except Exception as e: #Missing file, or one that doesn't fit the mesh anymore.
+            if stream_errors.get(ob.name) != str(e):
+                stream_errors[ob.name] = str(e)
+                print ("Unable to stream animation for", ob.name+":", e)
+            continue
+        stream_errors.pop(ob.name, None)
+        ob.data.update()
+        
+        
+def register_stream_handler ():
+    if stream_frame not in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.append(stream_frame)
+        
+        
+def unregister_stream_handler ():
+    if stream_frame in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(stream_frame)
+    close_streamed_files()
+    
+    
+def cache_path (animpath, modelname, ext):
+    #Caches are written next to the .blend file if it's saved, otherwise next to the animation file. Falls back to the temp folder if that isn't writable.
+    #Existing caches are never overwritten, they may be used by previously imported meshes. The name gets a _1, _2... suffix instead.
+    #Returns the path and whether it's in the temp folder.
+    if bpy.data.is_saved:
+        folder = bpy.path.abspath("//")
     else:
-        if mtname in bpy.data.materials:
-            for m in bpy.data.materials:
-                if m.name == mtname:
-                    ob.data.materials.append(m)
-                    break
-        else:
-            mt = bpy.data.materials.new(mtname)
-            ob.data.materials.append(mt)
-            
-        return len(ob.data.materials)-1
-    
-    
-#Animation File:    
-def get_anim_header (ANIMFILE):
-    numframes = int.from_bytes(ANIMFILE[0:2], 'little')
-    framesize = int.from_bytes(ANIMFILE[2:4], 'little')
-    
-    return numframes, framesize
-    
-    
-def get_anim_coords(ANIMFILE, frame, vertex_index, framesize, FORMAT):
-            
-    coords = []
-    if FORMAT == "UNREAL":
-        bytes = int.from_bytes(ANIMFILE[aheadersize+(frame*framesize)+(vertex_index*4):aheadersize+(frame*framesize)+(vertex_index*4+4)], 'little')
-        coords.append(unsign((bytes & 0x7ff)/8))
-        coords.append(unsign(((bytes >> 11) & 0x7ff)/8)*-1) #Unreal's Y axis is inverted from Blender's
-        coords.append(unsign(((bytes >> 22) & 0x3ff)/4))
-            
-    elif FORMAT == "ION":
-        address = aheadersize+(frame*framesize)+(vertex_index*8)
+        folder = os.path.dirname(os.path.abspath(animpath))
+    temp = not os.access(folder, os.W_OK)
+    if temp:
+        folder = tempfile.gettempdir()
+    
+    used = set()
+    for ob in bpy.data.objects:
+        for mod in ob.modifiers:
+            if mod.type == 'MESH_CACHE' and mod.filepath:
+                used.add(os.path.normcase(os.path.abspath(bpy.path.abspath(mod.filepath))))
+    
+    path = os.path.join(folder, modelname + ext)
+    i = 0
+    while os.path.exists(path) or os.path.normcase(os.path.abspath(path)) in used:
+        i += 1
+        path = os.path.join(folder, "{n}_{i}{e}".format(n=modelname, i=i, e=ext))
+        
+    return path, temp
+    
+    
+def remove_imported (ob, col, materials):
+    #Removes a partly imported mesh. materials are the materials that existed before the import, new ones are removed if nothing else uses them.
+    me = ob.data
+    bpy.data.objects.remove(ob)
+    bpy.data.meshes.remove(me)
+    bpy.data.collections.remove(col)
+    for mt in [mt for mt in bpy.data.materials if mt not in materials and mt.users == 0]:
+        bpy.data.materials.remove(mt)
         
-        coords.append(unsign((int.from_bytes(ANIMFILE[address:address+2], 'little'))/256))
-        coords.append(unsign((int.from_bytes(ANIMFILE[address+2:address+4], 'little'))/256)*-1) #Unreal's Y axis is inverted from Blender's
-        coords.append(unsign((int.from_bytes(ANIMFILE[address+4:address+6], 'little'))/256))
         
-    return coords
+def make_mesh(*args, **kwargs):
+    return progress_unreal_3d.run_steps(make_mesh_steps(*args, **kwargs))
     
-
-
-def make_mesh(PATH, IM_ANIM, FORMAT, IM_MATT, SCALE, A_START, A_END, FRAME):
+    
+def make_mesh_steps(PATH, IM_ANIM, FORMAT, IM_MATT, SCALE, A_START, A_END, FRAME, ANIM_MODE="SHAPEKEYS", DUPES="DROP", TIMING=False, TIMING_PATH=""):
+    #Generator that yields after every chunk of the point cache or shape key. If it's closed early (cancelled) everything imported so far is removed again.
+    #Returns a list of warnings for the user.
     #Creating proper paths for both files
     if PATH[-5:] == "_d.3d" or PATH[-5:] == "_a.3d":
         datapath = PATH[:-5] + "_d.3d"
@@ -144,143 +156,183 @@ def make_mesh(PATH, IM_ANIM, FORMAT, IM_MATT, SCALE, A_START, A_END, FRAME):
         animpath = os.path.splitext(PATH)[0] + "_a.3d"
         modelname = os.path.splitext(os.path.split(PATH)[1])[0]
     
+    global timer
+    timer = timing_unreal_3d.Timer("import", modelname, TIMING)
+    warnings = []
+    progress = progress_unreal_3d.Progress(bpy.context.window_manager, bpy.app.background)
+    
     print ("Opening data file:", datapath)
-    dfile = open(datapath, "r+b")    
-    DATAFILE = dfile.read()
-
+    with timer.span("read data file") as span:
+        with open(datapath, "rb") as dfile:
+            DATAFILE = dfile.read()
+        span.count = len(DATAFILE)
+    
+    #Data
+    with timer.span("polygon decode") as span:
+        polycount, vertcount, polys = codec_unreal_3d.read_data(DATAFILE)
+        span.count = polycount
+    
+    #Some meshes have multiple polygons that share the same vertices. Blender has no support having three vertices contain two polygons. So we either skip these or give them their own vertices.
+    with timer.span("polygon cleanup", polycount):
+        polys, vertindex, vertmap, degenerate, duplicates = codec_unreal_3d.clean_polys(polys, vertcount, DUPES)
+    if degenerate:
+        print ("Skipping", degenerate, "polygons that use the same vertex twice or a vertex that doesn't exist.")
+    if duplicates:
+        if DUPES == "SPLIT":
+            print ("Giving", duplicates, "polygons that use the same vertices as another polygon their own vertices.")
+        else:
+            print ("Skipping", duplicates, "polygons that use the same vertices as another polygon.")
+    polycount = len(polys)
+    
+    #Animation
     print ("Opening animation file:", animpath)
-    afile = open(animpath, "r+b")
-    ANIMFILE = afile.read()
+    with codec_unreal_3d.AnimFile(animpath) as afile:
+        numframes = afile.numframes
+        if IM_ANIM:
+            if A_START-1 < numframes:
+                frame = A_START-1
+            else:
+                frame = numframes-1
+        elif FRAME-1 < numframes:
+            frame = FRAME-1
+        else:
+            frame = numframes-1
+        
+        if FORMAT == "AUTO":
+            FORMAT = codec_unreal_3d.detect_format(afile.framesize, vertcount)
+            if FORMAT == "UNREAL":
+                print ("Animation format auto detected as UNREAL.")
+            elif FORMAT == "ION":
+                print ("Animation format auto detected as ION STORM.")
+            else:
+                raise Exception("Error: Unable to detect animation format. Aborting...")
+        
+        #Only the pages of the frames being imported are read from disk.
+        with timer.span("frame decode", vertcount):
+            coords = afile.decode(vertcount, FORMAT, SCALE, frame, frame+1, vertmap)[0]
+        if IM_ANIM == True and numframes > 1:
+            if A_END == 0 or A_END > numframes:
+                A_END = numframes
+            if ANIM_MODE == "PC2":
+                pc2path, temp = cache_path(animpath, modelname, ".pc2")
+                print ("Writing point cache:", pc2path)
+                if temp:
+                    warnings.append("Point cache written to the temp folder, which may get cleared: {p}. Save the .blend file to a writable folder and import again to keep it.".format(p=pc2path))
+                    print (warnings[-1])
+                progress.begin("Writing point cache", A_END-A_START+1)
+                steps = codec_unreal_3d.write_pc2_steps(afile, pc2path, vertcount, FORMAT, SCALE, A_START-1, A_END, vertmap)
+                written = 0
+                try:
+                    while True:
+                        with timer.span("point cache write") as span: #Only the work between the yields, not the time the modal operator waits.
+                            done = next(steps, None)
+                            if done is not None:
+                                span.count = vertcount*(done-written)
+                        if done is None:
+                            break
+                        written = done
+                        progress.update(done)
+                        yield
+                except GeneratorExit: #Cancelled.
+                    steps.close()
+                    os.remove(pc2path)
+                    raise
+                finally:
+                    progress.end()
+            elif ANIM_MODE == "STREAM":
+                pass #Frames are decoded on frame change by stream_frame.
+            #Shape keys decode their frames a batch at a time while they're built.
     
     scene = bpy.context.scene
+    materials = set(bpy.data.materials)
     col = bpy.data.collections.new(modelname)
     
     me = bpy.data.meshes.new(modelname)
     ob = bpy.data.objects.new(modelname, me)
     
-    bm = bmesh.new()
-    bm.from_mesh(me)
-    
     scene.collection.children.link(col)
     
-    bpy.data.collections[modelname].objects.link(ob)
+    col.objects.link(ob)
     bpy.context.view_layer.objects.active = ob
     
-    bpy.ops.object.mode_set(mode='EDIT', toggle = False)
-    
-    #Data
-    polycount, vertcount = get_data_header(DATAFILE)
-    
-    print ("\nCreating vertices...")
-    for v in range(vertcount): #create vertices
-        bm.verts.new ()
-        ofprint(v+1, "of", vertcount)
-
-    bm.verts.ensure_lookup_table()
-    
-    uv_layer = bm.loops.layers.uv.verify()
-    #bm.faces.layers.tex.verify()
-    
-    print ("\n\nCreating polygons...")
-    for p in range(polycount): #create polygons
-        vertindex, polyflags, uvs, texnum = get_data_polys(DATAFILE,p)
-        try: 
-            polygon = bm.faces.new((bm.verts[vertindex[0]], bm.verts[vertindex[1]], bm.verts[vertindex[2]]))
-        except ValueError as e: 
-            #Some meshes have multiple polygons that share the same vertices which causes a ValueError. Blender has no support having three vertices contain two polygons. So we skip creating these.
-            print('\nError on polygon',str(p+1)+':', e, ', Skipping.')
-            continue
-            
-        polygon.smooth = True
-        if IM_MATT:
-            polygon.material_index = assign_materials(texnum, polyflags, ob, modelname)
+    print ("\nCreating vertices at frame", str(frame)+"...")
+    with timer.span("vertex creation", len(coords)):
+        me.vertices.add(len(coords))
+        me.vertices.foreach_set("co", coords.ravel())
+    
+    print ("\nCreating polygons...")
+    with timer.span("polygon creation", polycount):
+        #Unreal's winding order is the opposite of Blender's so the second and third vertex of every polygon are swapped.
+        me.loops.add(polycount*3)
+        me.loops.foreach_set("vertex_index", codec_unreal_3d.loop_vertices(vertindex))
+        me.polygons.add(polycount)
+        me.polygons.foreach_set("loop_start", np.arange(0, polycount*3, 3, dtype=np.int32))
+        me.polygons.foreach_set("use_smooth", np.ones(polycount, dtype=bool))
         
-        for i, loop in enumerate(polygon.loops):
-            uv = loop[uv_layer].uv
-            uv[0] = uvs[i][0]/256
-            uv[1] = ((uvs[i][1]/256)*-1)+1
-       
-        ofprint(p+1, "of", polycount)
+        me.uv_layers.new().data.foreach_set("uv", codec_unreal_3d.loop_uvs(polys).ravel())
     
+    if IM_MATT:
+        with timer.span("material assignment", polycount):
+            assign_all_materials(polys, ob, modelname)
     
-    #Animation
-    numframes, framesize = get_anim_header(ANIMFILE)
-    if IM_ANIM:
-        if A_START-1 <= numframes:
-            frame = A_START-1
-        else:
-            frame = numframes
-    elif FRAME-1 <= numframes:
-        frame = FRAME-1
-    else:
-        frame = numframes
-    
-    if FORMAT == "AUTO":
-        fsize = framesize/vertcount
-        if fsize == 4:
-            FORMAT = "UNREAL"
-            print ("Animation format auto detected as UNREAL.")
-        elif fsize == 8:
-            FORMAT = "ION"
-            print ("Animation format auto detected as ION STORM.")
-        else:
-            raise Exception("Error: Unable to detect animation format. Aborting...")
-            
-    print ("\n\nMoving vertices to frame", str(frame)+"...")
-    for v in range(len(bm.verts)):
-        coords = get_anim_coords(ANIMFILE, frame, v, framesize, FORMAT)
-        #print ("coords=", coords)
-        coords = [c*SCALE for c in coords]
-        bm.verts[v].co = (coords)
-        ofprint (v+1, "of", len(bm.verts))
-    
-    bm.normal_update()
-    bpy.ops.object.mode_set(mode='OBJECT', toggle = False)
-    bm.to_mesh(me)
-    
-    bpy.ops.object.mode_set(mode='EDIT', toggle = False)
-    bpy.ops.mesh.select_all(action='SELECT')
-    #bpy.ops.mesh.normals_make_consistent(inside=False)
-    bpy.ops.mesh.flip_normals()
-    bpy.ops.object.mode_set(mode='OBJECT', toggle = False)
-    bm.free()
+    with timer.span("mesh update", polycount):
+        me.update(calc_edges=True)
     
 
-    if IM_ANIM == True and numframes > 1: #Importing Animation
+    if IM_ANIM == True and numframes > 1 and ANIM_MODE == "PC2": #Importing Animation as a point cache
+        print ("\n\nImporting Animation...")
+        bpy.context.scene.frame_start = 0
+        bpy.context.scene.frame_end = A_END-A_START
+        mod = ob.modifiers.new("MeshCache", 'MESH_CACHE')
+        mod.cache_format = 'PC2'
+        mod.filepath = bpy.path.relpath(pc2path) if bpy.data.is_saved else pc2path
+        mod.frame_start = 0
+        bpy.context.scene.frame_set(0)
+        
+    elif IM_ANIM == True and numframes > 1 and ANIM_MODE == "STREAM": #Streaming Animation from the _a.3d file on frame change
         print ("\n\nImporting Animation...")
-        if A_END == 0 or A_END > numframes:
-            A_END = numframes
         bpy.context.scene.frame_start = 0
         bpy.context.scene.frame_end = A_END-A_START
-        for frame in range(A_START-1, A_END):
-            keyname = 'Frame'+str(frame-A_START+1)
-            ob.shape_key_add(name=keyname, from_mix=False)
-            
-            me = ob.data
-            bm = bmesh.new()
-            bm.from_mesh(me)
-            shape = bm.verts.layers.shape.get(keyname)
-            bm.verts.ensure_lookup_table()
-            
-            for v in range(len(bm.verts)):
-                coords = get_anim_coords(ANIMFILE, frame, v, framesize, FORMAT)
-                coords = [c*SCALE for c in coords]
-                bm.verts[v][shape]= (coords)
-                if bDebug:
-                    out = "Adding Frame %d of %d. Vertice %d of %d." % (frame+1, A_END-A_START+1, v+1, len(bm.verts))
-                    sys.stdout.write('\r' + ' '*len(out))
-                    sys.stdout.write('\r')
-                    sys.stdout.flush()
-                    sys.stdout.write(out)
-                    sys.stdout.flush() 
-                
-            bm.to_mesh(me)
-            bm.free()
-            ob.data.shape_keys.key_blocks[keyname].interpolation = 'KEY_LINEAR'
-            # ob.data.shape_keys.key_blocks[keyname].keyframe_insert("value",frame=frame-A_START+2) #old code using Relative Shape keys.
-            # ob.data.shape_keys.key_blocks[keyname].keyframe_insert("value",frame=frame-A_START)
-            # ob.data.shape_keys.key_blocks[keyname].value = 1
-            # ob.data.shape_keys.key_blocks[keyname].keyframe_insert("value",frame=frame-A_START+1)
+        ob["u3d_stream"] = {"path": bpy.path.relpath(animpath) if bpy.data.is_saved else animpath,
+                            "format": FORMAT,
+                            "scale": SCALE,
+                            "start": A_START-1,
+                            "end": A_END,
+                            "vertcount": vertcount,
+                            "split": [] if vertmap is None else vertmap[vertcount:].tolist()}
+        register_stream_handler()
+        bpy.context.scene.frame_set(0)
+        
+    elif IM_ANIM == True and numframes > 1: #Importing Animation
+        print ("\n\nImporting Animation...")
+        bpy.context.scene.frame_start = 0
+        bpy.context.scene.frame_end = A_END-A_START
+        progress.begin("Building shape keys", A_END-A_START+1)
+        step = max(1, (1 << 20) // (len(coords)*12)) #Frames decoded at a time. Keeps every step short and only one batch in memory.
+        try:
+            with codec_unreal_3d.AnimFile(animpath) as afile:
+                for first in range(A_START-1, A_END, step):
+                    with timer.span("frame decode", vertcount*(min(first+step, A_END)-first)):
+                        frames = afile.decode(vertcount, FORMAT, SCALE, first, min(first+step, A_END), vertmap)
+                    yield
+                    for frame in range(first, min(first+step, A_END)):
+                        with timer.span("shape key build", vertcount):
+                            keyname = 'Frame'+str(frame-A_START+1)
+                            shape = ob.shape_key_add(name=keyname, from_mix=False)
+                            shape.data.foreach_set("co", frames[frame-first].ravel())
+                            shape.interpolation = 'KEY_LINEAR'
+                        progress.step()
+                        yield
+                        # ob.data.shape_keys.key_blocks[keyname].keyframe_insert("value",frame=frame-A_START+2) #old code using Relative Shape keys.
+                        # ob.data.shape_keys.key_blocks[keyname].keyframe_insert("value",frame=frame-A_START)
+                        # ob.data.shape_keys.key_blocks[keyname].value = 1
+                        # ob.data.shape_keys.key_blocks[keyname].keyframe_insert("value",frame=frame-A_START+1)
+                    del frames
+        except GeneratorExit: #Cancelled.
+            remove_imported(ob, col, materials)
+            raise
+        finally:
+            progress.end()
         ob.data.shape_keys.use_relative = False
         ob.data.shape_keys.eval_time = 0
         ob.data.shape_keys.keyframe_insert("eval_time", frame=0)
@@ -289,9 +341,19 @@ def make_mesh(PATH, IM_ANIM, FORMAT, IM_MATT, SCALE, A_START, A_END, FRAME):
         ob.data.shape_keys.animation_data.action.fcurves[0].keyframe_points[0].interpolation = 'LINEAR'
         ob.data.shape_keys.animation_data.action.fcurves[0].keyframe_points[1].interpolation = 'LINEAR'
         bpy.context.scene.frame_set(0)
+        
+    timer.report(TIMING_PATH)
+    return warnings
 
-def load (operator, context, filepath, i_anim, a_format, i_matt, i_scale, frame_start, frame_end, frame_single):
+def load (operator, context, filepath, i_anim, a_format, i_matt, i_scale, frame_start, frame_end, frame_single, anim_mode="SHAPEKEYS", i_dupes="DROP", timing=False, timing_path=""):
+    
+    return progress_unreal_3d.run_steps(load_steps(operator, context, filepath, i_anim, a_format, i_matt, i_scale, frame_start, frame_end, frame_single, anim_mode, i_dupes, timing, timing_path))
+    
+    
+def load_steps (operator, context, filepath, i_anim, a_format, i_matt, i_scale, frame_start, frame_end, frame_single, anim_mode="SHAPEKEYS", i_dupes="DROP", timing=False, timing_path=""):
     
-    make_mesh(filepath, i_anim, a_format, i_matt, i_scale, frame_start, frame_end, frame_single)
+    warnings = yield from make_mesh_steps(filepath, i_anim, a_format, i_matt, i_scale, frame_start, frame_end, frame_single, anim_mode, i_dupes, timing, bpy.path.abspath(timing_path) if timing_path else "")
+    for warning in warnings:
+        operator.report({'WARNING'}, warning)
     
     return {'FINISHED'}
@@ -0,0 +1,75 @@
+#   V1.4.0
+#   Progress reporting for long imports and exports. Updates are sent at most every interval seconds no matter how often update is called.
+#   Long running work is written as generators that yield after every small step so it can also be run in chunks by a modal operator.
+#   A step yields None after doing some work, or a number of seconds when it's only waiting for something else (like the export workers).
+#   This module must not import bpy. The window manager is passed in by the caller.
+import sys
+import time
+
+
+class Progress:
+    #wm is a bpy.types.WindowManager (progress shown in the UI), console prints the progress on one line (for blender -b).
+    def __init__(self, wm=None, console=False, interval=0.25):
+        self.wm = wm
+        self.console = console
+        self.interval = interval
+        self.label = ""
+        self.total = 0
+        self.done = 0
+        self.active = False
+
+    def begin(self, label, total):
+        if self.active:
+            self.end()
+        self.label = label
+        self.total = max(int(total), 1)
+        self.done = 0
+        self.active = True
+        self.next = time.perf_counter() + self.interval
+        if self.wm is not None:
+            self.wm.progress_begin(0, self.total)
+
+    def update(self, done):
+        self.done = done
+        now = time.perf_counter()
+        if not self.active or now < self.next:
+            return
+        self.next = now + self.interval
+        self.send()
+
+    def step(self, count=1):
+        self.update(self.done + count)
+
+    def send(self):
+        if self.wm is not None:
+            self.wm.progress_update(min(self.done, self.total))
+        if self.console:
+            self.print()
+
+    def print(self):
+        done = min(self.done, self.total)
+        sys.stdout.write("\r{l}: {d}/{t} ({p:.0f}%)".format(l=self.label, d=done, t=self.total, p=done*100/self.total))
+        sys.stdout.flush()
+
+    def end(self):
+        if not self.active:
+            return
+        self.active = False
+        if self.wm is not None:
+            self.wm.progress_end()
+        if self.console:
+            self.print()
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+
+def run_steps (steps):
+    #Runs a generator of work steps (see the *_steps functions) to the end and returns its return value.
+    #The modal operators run the same generators a few steps at a time instead, and go back to Blender's event loop instead of sleeping.
+    while True:
+        try:
+            wait = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        if wait is not None:
+            time.sleep(wait)
@@ -0,0 +1,174 @@
+#   V1.4.0
+#   Fast path for exporting meshes that are only deformed by an Armature modifier.
+#   Instead of evaluating the whole scene for every frame, the action's fcurves are sampled directly and the mesh is skinned with NumPy.
+import re
+import bpy
+import numpy as np
+from mathutils import Matrix, Quaternion, Euler, Vector
+
+channels = ("location", "rotation_quaternion", "rotation_euler", "rotation_axis_angle", "scale")
+
+bone_path = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]\.(\w+)$')
+
+
+def active_tracks (ad):
+    #Muted tracks, like the "[Action Stash]" tracks Blender adds when switching actions, don't affect the result.
+    return [track for track in ad.nla_tracks if not track.mute]
+
+
+def is_animated (id):
+    ad = id.animation_data
+    return ad is not None and (ad.action is not None or len(ad.drivers) or len(active_tracks(ad)))
+
+
+def get_armature (ob):
+    #Returns the armature object if ob is only deformed by a single Armature modifier that this module can reproduce. Otherwise None.
+    if ob.type != 'MESH' or ob.data.shape_keys is not None or ob.constraints:
+        return None
+    if ob.parent is not None and ob.parent_type in ('ARMATURE', 'BONE'): #Deformed or moved by the pose.
+        return None
+
+    mods = [m for m in ob.modifiers if m.show_viewport]
+    if len(mods) != 1 or mods[0].type != 'ARMATURE':
+        return None
+    mod = mods[0]
+    arm = mod.object
+    if arm is None or arm.type != 'ARMATURE':
+        return None
+    if not mod.use_vertex_groups or mod.use_bone_envelopes or mod.use_deform_preserve_volume or mod.use_multi_modifier or mod.vertex_group:
+        return None
+
+    if arm.data.pose_position == 'REST': #The depsgraph exports the rest pose then.
+        return None
+    if arm.constraints or any(pb.constraints for pb in arm.pose.bones): #IK and the like.
+        return None
+    if any(b.use_deform and b.bbone_segments > 1 for b in arm.data.bones): #B-Bones deform along a curve.
+        return None
+
+    #Drivers, NLA strips and anything moving the objects themselves would need the depsgraph.
+    #The armature itself is usually the mesh's parent and has the exported action assigned. Its object transform is checked by ArmatureSkin.supports_action.
+    if is_animated(ob.data) or is_animated(arm.data):
+        return None
+    for o in (ob, arm):
+        ad = o.animation_data
+        if ad is not None and (len(ad.drivers) or len(active_tracks(ad))):
+            return None
+        parent = o.parent
+        while parent is not None:
+            if parent != arm and (is_animated(parent) or parent.constraints):
+                return None
+            parent = parent.parent
+
+    return arm
+
+
+class ArmatureSkin:
+    #Linear blend skinning of ob by the pose of arm, matching Blender's Armature modifier (vertex groups, no preserve volume, no envelopes).
+    def __init__(self, ob, arm):
+        self.ob = ob
+        self.arm = arm
+        bones = arm.data.bones
+
+        self.order = [] #Parents before children.
+        todo = [b for b in bones if b.parent is None]
+        while todo:
+            bone = todo.pop()
+            self.order.append(bone)
+            todo.extend(bone.children)
+
+        self.deform = [b for b in self.order if b.use_deform]
+        self.inv_rest = [b.matrix_local.inverted() for b in self.deform]
+
+        #Weights. Only vertex groups with the name of a deforming bone count.
+        column = {b.name: i for i, b in enumerate(self.deform)}
+        groups = {vg.index: column[vg.name] for vg in ob.vertex_groups if vg.name in column}
+        me = ob.data
+        self.weights = np.zeros((len(me.vertices), len(self.deform)), dtype=np.float64)
+        for v in me.vertices:
+            for g in v.groups:
+                if g.group in groups:
+                    self.weights[v.index, groups[g.group]] += g.weight
+
+        contrib = self.weights.sum(axis=1)
+        self.skinned = contrib > 0.0001 #Same threshold as the Armature modifier. Other vertices stay where they are.
+        self.weights[self.skinned] /= contrib[self.skinned, None]
+
+        #Vertices are deformed in the armature's space.
+        premat = np.array(arm.matrix_world.inverted() @ ob.matrix_world)
+        self.postmat = np.linalg.inv(premat)
+        co = np.empty(len(me.vertices)*3, dtype=np.float32)
+        me.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3).astype(np.float64)
+        self.rest = co @ premat[:3, :3].T + premat[:3, 3]
+
+        self.fcurves = []
+        self.values = {}
+
+    def supports_action (self, action):
+        #Only actions that animate nothing but the bones' loc/rot/scale can be sampled without the depsgraph.
+        for fcu in action.fcurves:
+            match = bone_path.match(fcu.data_path)
+            if match is None or match.group(2) not in channels:
+                return False
+            if bpy.utils.unescape_identifier(match.group(1)) not in self.arm.pose.bones:
+                return False
+        return True
+
+    def set_action (self, action):
+        #Channels without fcurves keep whatever value the pose bone currently has, same as when the depsgraph evaluates the action.
+        self.values = {pb.name: {c: list(getattr(pb, c)) for c in channels} for pb in self.arm.pose.bones}
+        self.fcurves = []
+        for fcu in action.fcurves:
+            if fcu.mute:
+                continue
+            match = bone_path.match(fcu.data_path)
+            values = self.values[bpy.utils.unescape_identifier(match.group(1))][match.group(2)]
+            if fcu.array_index < len(values):
+                self.fcurves.append((values, fcu.array_index, fcu))
+
+    def basis (self, pb):
+        values = self.values[pb.name]
+        if pb.rotation_mode == 'QUATERNION':
+            rot = Quaternion(values["rotation_quaternion"]).normalized().to_matrix()
+        elif pb.rotation_mode == 'AXIS_ANGLE':
+            angle, *axis = values["rotation_axis_angle"]
+            axis = Vector(axis)
+            rot = Matrix.Rotation(angle, 3, axis.normalized()) if axis.length else Matrix.Identity(3)
+        else:
+            rot = Euler(values["rotation_euler"], pb.rotation_mode).to_matrix()
+
+        return Matrix.LocRotScale(Vector(values["location"]), rot, Vector(values["scale"]))
+
+    def evaluate (self, frame, out):
+        #Writes the skinned vertex positions (in the mesh object's space) at frame into out.
+        for values, index, fcu in self.fcurves:
+            values[index] = fcu.evaluate(frame)
+
+        pose = {}
+        pose_bones = self.arm.pose.bones
+        for bone in self.order:
+            basis = self.basis(pose_bones[bone.name])
+            if bone.parent is None:
+                pose[bone.name] = bone.convert_local_to_pose(basis, bone.matrix_local)
+            else:
+                pose[bone.name] = bone.convert_local_to_pose(basis, bone.matrix_local,
+                                                             parent_matrix=pose[bone.parent.name],
+                                                             parent_matrix_local=bone.parent.matrix_local)
+
+        deform = np.array([(pose[b.name] @ inv)[:3] for b, inv in zip(self.deform, self.inv_rest)], dtype=np.float64).reshape(len(self.deform), 12)
+        blend = (self.weights @ deform).reshape(-1, 3, 4)
+
+        co = self.rest.copy()
+        rest = self.rest[self.skinned]
+        blend = blend[self.skinned]
+        co[self.skinned] = np.einsum("vij,vj->vi", blend[:, :, :3], rest) + blend[:, :, 3]
+
+        out.reshape(-1, 3)[:] = co @ self.postmat[:3, :3].T + self.postmat[:3, 3]
+
+
+def get_skin (ob):
+    #Returns an ArmatureSkin for ob if it can be exported without the depsgraph, otherwise None.
+    arm = get_armature(ob)
+    if arm is None or not len(arm.data.bones):
+        return None
+    return ArmatureSkin(ob, arm)
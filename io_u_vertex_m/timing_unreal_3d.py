@@ -0,0 +1,122 @@
+#   V1.4.0
+#   Timing of the import and export phases. Spans of a disabled Timer do nothing so they can stay in the code.
+#   This module must not import bpy so it can be used outside of Blender.
+import os
+import sys
+import json
+import time
+
+
+class Span:
+    #Adds the time between entering and leaving to its phase. Set count to the number of elements handled, if it isn't known up front.
+    def __init__(self, timer, name, count):
+        self.timer = timer
+        self.name = name
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.add(self.name, time.perf_counter() - self.start, self.count)
+
+
+class NullSpan:
+    count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __setattr__(self, name, value): #One instance is shared by all disabled spans.
+        pass
+
+
+nullspan = NullSpan()
+
+
+class Timer:
+    def __init__(self, operation, name="", enabled=False):
+        self.operation = operation
+        self.name = name
+        self.enabled = enabled
+        self.phases = {} #name: [seconds, count, calls] in the order the phases first ran.
+        self.start = time.perf_counter()
+
+    def span(self, name, count=0):
+        if not self.enabled:
+            return nullspan
+        return Span(self, name, count)
+
+    def add(self, name, seconds, count=0):
+        phase = self.phases.setdefault(name, [0.0, 0, 0])
+        phase[0] += seconds
+        phase[1] += count
+        phase[2] += 1
+
+    def results(self):
+        return {"operation": self.operation,
+                "name": self.name,
+                "total": time.perf_counter() - self.start,
+                "phases": [{"name": name, "seconds": seconds, "count": count, "calls": calls,
+                            "per_second": count/seconds if count and seconds > 0 else None}
+                           for name, (seconds, count, calls) in self.phases.items()]}
+
+    def report(self, path=""):
+        #Prints the phases and writes them to path as JSON if given. Does nothing if the timer is disabled.
+        if not self.enabled:
+            return
+        results = self.results()
+        print ("\n{o} timing of {n} ({t:.1f} ms total):".format(o=self.operation.capitalize(), n=self.name, t=results["total"]*1000))
+        print ("    {p:<24}{t:>12}{c:>12}{s:>16}".format(p="Phase", t="Time (ms)", c="Count", s="Per second"))
+        for phase in results["phases"]:
+            rate = "{r:.0f}".format(r=phase["per_second"]) if phase["per_second"] else ""
+            print ("    {p:<24}{t:>12.2f}{c:>12}{s:>16}".format(p=phase["name"], t=phase["seconds"]*1000, c=phase["count"] or "", s=rate))
+
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print ("Timing written to", path)
+
+
+#=======================================================================
+# Process memory. Unlike tracemalloc this includes what Blender allocates itself (meshes) and costs nothing until it's called.
+#=======================================================================
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    def memory_usage ():
+        #Returns the current and peak resident memory of the process in bytes.
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize, counters.PeakWorkingSetSize
+else:
+    import resource
+
+    def memory_usage ():
+        #Returns the current (None if unknown, e.g. on macOS) and peak resident memory of the process in bytes.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024 #Bytes on macOS, kilobytes elsewhere.
+        try:
+            with open("/proc/self/statm") as f:
+                current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            current = None
+        return current, peak
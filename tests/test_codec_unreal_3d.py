@@ -0,0 +1,237 @@
+#   Tests for codec_unreal_3d. The expected values come from the per-vertex and per-loop code the codec replaced (corcoords, unsign and the UV loop of prep_data).
+#   Run from the repository root with: python -m pytest tests
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_u_vertex_m import codec_unreal_3d
+
+
+#=======================================================================
+# The old code, one value at a time.
+#=======================================================================
+def corcoords (val, mult, SCALE):
+    if val * SCALE < -128:
+        return -128 * mult
+    if val * SCALE > 127:
+        return 127 * mult
+
+    return int(round(val * mult * SCALE, 0))
+
+
+def unsign (i):
+    if i >= 128:
+        return i - 256
+    else:
+        return i
+
+
+def old_encode_frame (co, FORMAT, SCALE):
+    out = bytearray()
+    for x, y, z in co.tolist():
+        if FORMAT == "UNREAL":
+            packed = (corcoords(x, 8, SCALE) & 0x7ff)
+            packed += ((corcoords(y*-1, 8, SCALE) & 0x7ff) << 11)
+            packed += ((corcoords(z, 4, SCALE) & 0x3ff) << 22)
+            out += packed.to_bytes(4, 'little')
+        else:
+            out += (corcoords(x, 256, SCALE) & 0xffff).to_bytes(2, 'little')
+            out += (corcoords(y*-1, 256, SCALE) & 0xffff).to_bytes(2, 'little')
+            out += (corcoords(z, 256, SCALE) & 0xffff).to_bytes(2, 'little')
+            out += (0).to_bytes(2, 'little')
+    return bytes(out)
+
+
+def old_decode_vertex (ANIMFILE, frame, vertex_index, framesize, FORMAT):
+    if FORMAT == "UNREAL":
+        address = codec_unreal_3d.aheadersize + frame*framesize + vertex_index*4
+        packed = int.from_bytes(ANIMFILE[address:address+4], 'little')
+        return [unsign((packed & 0x7ff)/8),
+                unsign(((packed >> 11) & 0x7ff)/8)*-1,
+                unsign(((packed >> 22) & 0x3ff)/4)]
+
+    address = codec_unreal_3d.aheadersize + frame*framesize + vertex_index*8
+    return [unsign(int.from_bytes(ANIMFILE[address:address+2], 'little')/256),
+            unsign(int.from_bytes(ANIMFILE[address+2:address+4], 'little')/256)*-1,
+            unsign(int.from_bytes(ANIMFILE[address+4:address+6], 'little')/256)]
+
+
+def old_uv (u, v):
+    tempuv = [int((u+(1/255))*255), abs(int(v*255)-255)]
+    for i, i2 in enumerate(tempuv):
+        if i2 < 0:
+            tempuv[i] = 0
+        if i2 > 255:
+            tempuv[i] = 255
+    return tempuv
+
+
+def old_polys (vertindex, texnum, polyflags, uvs):
+    data = bytearray()
+    for p in range(len(vertindex)):
+        v = [int(i).to_bytes(2, 'little') for i in vertindex[p]]
+        uv = [old_uv(float(u), float(vv)) for u, vv in uvs[p]]
+        data += v[0] + v[2] + v[1]
+        data += int(polyflags[p]).to_bytes(1, 'little') + (0).to_bytes(1, 'little')
+        for corner in (0, 2, 1):
+            data += bytes(uv[corner])
+        data += int(texnum[p]).to_bytes(1, 'little') + (0).to_bytes(1, 'little')
+    return bytes(data)
+
+
+#=======================================================================
+# Animation frames.
+#=======================================================================
+#Exact .5 ties after scaling (rounded to even like Python's round), values right at and past the clamping borders and random ones.
+edge_values = [0, 0.0625, -0.0625, 0.1875, -0.1875, 0.125, 0.375, 1/512, 3/512, -1/512,
+               126.9, 127, 127.0625, 127.5, 200, -127.9, -128, -128.0625, -300]
+
+
+def frame_coords (seed=0):
+    rng = np.random.default_rng(seed)
+    edges = np.array(edge_values, dtype=np.float64)
+    co = np.concatenate((np.stack((edges, -edges, edges), axis=1),
+                         np.stack((edges, edges, -edges), axis=1),
+                         rng.uniform(-140, 140, (200, 3))))
+    return co.astype(np.float32) #Blender's coordinates are single precision.
+
+
+@pytest.mark.parametrize("FORMAT", ["UNREAL", "ION"])
+@pytest.mark.parametrize("SCALE", [1, 0.5, 2.5])
+def test_encode_frame_matches_corcoords (FORMAT, SCALE):
+    co = frame_coords()
+    assert codec_unreal_3d.encode_frame(co, FORMAT, SCALE).tobytes() == old_encode_frame(co, FORMAT, SCALE)
+
+
+@pytest.mark.parametrize("FORMAT, vertsize", [("UNREAL", 4), ("ION", 8)])
+def test_decode_frames_matches_unsign (FORMAT, vertsize):
+    #Every possible value of every field, so the sign extension is checked at all borders.
+    rng = np.random.default_rng(1)
+    vertcount = 2048
+    framesize = vertcount * vertsize
+    if FORMAT == "UNREAL":
+        fields = np.stack((np.arange(vertcount), rng.permutation(vertcount), np.arange(vertcount) % 1024), axis=1)
+        frames = (fields[:, 0] | (fields[:, 1] << 11) | (fields[:, 2] << 22)).astype("<u4")
+    else:
+        frames = np.zeros((vertcount, 4), dtype="<u2")
+        frames[:, :3] = rng.integers(0, 0x10000, (vertcount, 3))
+        frames[:16, 0] = [0, 1, 0x7fff, 0x8000, 0x8001, 0xffff, 0x7f00, 0x8100, 0x80ff, 0x7fff, 0x100, 0xff00, 0x00ff, 0xff80, 0x0080, 0xfffe]
+    ANIMFILE = np.array([(2, framesize)], dtype=codec_unreal_3d.anim_header_dtype).tobytes() + frames.tobytes() + frames[::-1].tobytes()
+
+    decoded = codec_unreal_3d.decode_frames(ANIMFILE, vertcount, framesize, FORMAT)
+    assert decoded.shape == (2, vertcount, 3)
+    expected = np.array([[old_decode_vertex(ANIMFILE, f, v, framesize, FORMAT) for v in range(vertcount)] for f in range(2)])
+    np.testing.assert_array_equal(decoded, expected.astype(np.float32))
+
+
+@pytest.mark.parametrize("FORMAT", ["UNREAL", "ION"])
+def test_frame_round_trip (FORMAT):
+    co = np.random.default_rng(2).uniform(-120, 120, (500, 3)).astype(np.float32)
+    packed = codec_unreal_3d.encode_frame(co, FORMAT)
+    ANIMFILE = np.array([(1, packed.nbytes)], dtype=codec_unreal_3d.anim_header_dtype).tobytes() + packed.tobytes()
+
+    decoded = codec_unreal_3d.decode_frames(ANIMFILE, len(co), packed.nbytes, FORMAT)[0]
+    step = np.array([1/8, 1/8, 1/4]) if FORMAT == "UNREAL" else np.full(3, 1/256)
+    assert np.all(np.abs(decoded - co) <= step/2 + 1e-6)
+
+
+#=======================================================================
+# Polygons.
+#=======================================================================
+uv_edges = [0, 1, 0.5, -0.1, 1.2, 1/255, 254/255, 254.5/255, 0.999, 0.001, -1/255, 256/255]
+
+
+def test_quantize_uvs_matches_old_loop ():
+    rng = np.random.default_rng(3)
+    uvs = np.concatenate((np.array([(u, v) for u in uv_edges for v in uv_edges]), rng.uniform(-0.2, 1.2, (500, 2)))).astype(np.float32)
+    expected = np.array([old_uv(float(u), float(v)) for u, v in uvs])
+    np.testing.assert_array_equal(codec_unreal_3d.quantize_uvs(uvs), expected)
+
+
+def test_encode_polys_matches_old_prep_data ():
+    rng = np.random.default_rng(4)
+    polycount = 300
+    vertindex = rng.integers(0, 0x10000, (polycount, 3))
+    texnum = rng.integers(0, 256, polycount)
+    polyflags = rng.integers(0, 256, polycount)
+    uvs = rng.uniform(-0.1, 1.1, (polycount, 3, 2)).astype(np.float32)
+    uvs[:len(uv_edges), 0, 0] = uv_edges
+
+    table = codec_unreal_3d.encode_polys(vertindex, texnum, polyflags, uvs)
+    assert table.tobytes() == old_polys(vertindex, texnum, polyflags, uvs)
+
+
+def test_encode_polys_without_uvs ():
+    table = codec_unreal_3d.encode_polys(np.array([[0, 1, 2]]), [3], [1])
+    assert table.tobytes() == bytes([0, 0, 2, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 3, 0])
+
+
+#=======================================================================
+# Polygons Blender can't have.
+#=======================================================================
+def old_created_polys (vertindex, vertcount):
+    #Which polygons the old importer ended up creating: bm.faces.new failed on repeated, missing and already used vertex triples.
+    created = []
+    seen = set()
+    for i, tri in enumerate(vertindex.tolist()):
+        if len(set(tri)) < 3 or max(tri) >= vertcount or frozenset(tri) in seen:
+            continue
+        seen.add(frozenset(tri))
+        created.append(i)
+    return created
+
+
+def make_table (vertindex):
+    table = np.zeros(len(vertindex), dtype=codec_unreal_3d.poly_dtype)
+    table["vertindex"] = vertindex
+    table["texnum"] = np.arange(len(vertindex)) % 256
+    return table
+
+
+def test_duplicate_polys ():
+    vertindex = np.array([[0, 1, 2], [2, 1, 0], [1, 2, 3], [0, 2, 1], [3, 2, 1], [0, 1, 3]])
+    np.testing.assert_array_equal(codec_unreal_3d.duplicate_polys(vertindex), [False, True, False, True, True, False])
+
+
+def test_split_polys ():
+    vertindex = np.array([[0, 1, 2], [2, 1, 0], [1, 2, 3], [0, 2, 1]])
+    split = np.array([False, True, False, True])
+    newindex, vertmap = codec_unreal_3d.split_polys(vertindex, split, 4)
+
+    np.testing.assert_array_equal(newindex, [[0, 1, 2], [4, 5, 6], [1, 2, 3], [7, 8, 9]])
+    np.testing.assert_array_equal(vertmap, [0, 1, 2, 3, 2, 1, 0, 0, 2, 1])
+    np.testing.assert_array_equal(vertmap[newindex], vertindex) #Every copy stands for the vertex it was split from.
+    assert not codec_unreal_3d.duplicate_polys(newindex).any()
+
+
+def test_clean_polys_drop_matches_old_importer ():
+    rng = np.random.default_rng(5)
+    vertcount = 12
+    vertindex = rng.integers(0, vertcount+1, (400, 3)) #Plenty of degenerate, out of range and duplicate polygons.
+    polys, cleanindex, vertmap, degenerate, duplicates = codec_unreal_3d.clean_polys(make_table(vertindex), vertcount, "DROP")
+
+    created = old_created_polys(vertindex, vertcount)
+    assert vertmap is None
+    np.testing.assert_array_equal(polys["texnum"], np.array(created) % 256)
+    np.testing.assert_array_equal(cleanindex, vertindex[created])
+    assert degenerate + duplicates + len(created) == len(vertindex)
+
+
+def test_clean_polys_split ():
+    vertindex = np.array([[0, 1, 2], [0, 0, 1], [2, 1, 0], [1, 2, 3], [0, 1, 9], [3, 2, 1]])
+    polys, cleanindex, vertmap, degenerate, duplicates = codec_unreal_3d.clean_polys(make_table(vertindex), 4, "SPLIT")
+
+    assert (degenerate, duplicates) == (2, 2)
+    np.testing.assert_array_equal(polys["texnum"], [0, 2, 3, 5]) #Only the degenerate ones are gone.
+    np.testing.assert_array_equal(vertmap[cleanindex], vertindex[[0, 2, 3, 5]])
+    assert len(vertmap) == 4 + 6
+    assert not codec_unreal_3d.duplicate_polys(cleanindex).any()
+
+
+def test_clean_polys_without_problems ():
+    vertindex = np.array([[0, 1, 2], [1, 2, 3]])
+    polys, cleanindex, vertmap, degenerate, duplicates = codec_unreal_3d.clean_polys(make_table(vertindex), 4, "SPLIT")
+    assert vertmap is None and (degenerate, duplicates) == (0, 0)
+    np.testing.assert_array_equal(cleanindex, vertindex)